@@ -1,31 +1,95 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import DEFAULT_DB_ALIAS
 
 from eshopper.main.models import Customer, Product, Order, OrderItem, ShippingAddress, Contact
+from eshopper.main.pagination import EstimatedCountPaginator
+from eshopper.main.routers import get_read_database
+
+
+class ReplicaChangeList(ChangeList):
+    def get_queryset(self, request):
+        # reporting reads, a replica serves them unless the request wrote or is pinned
+        return super().get_queryset(request).using(get_read_database())
+
+
+class OrderChangeList(ReplicaChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # the totals join every item of the orders they cover, so only the shown page gets them
+        self.result_list = self.queryset.filter(pk__in=self.result_list.values('pk')).with_totals()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # the "n total" link would run an exact COUNT(*) on every filtered page
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return ReplicaChangeList
+
+    def get_queryset(self, request):
+        # change and delete views start from the primary, a form filled from a replica row
+        # that lags behind would save the old values over newer ones
+        return super().get_queryset(request).using(DEFAULT_DB_ALIAS)
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('__str__', 'email', 'user')
+    list_select_related = ('user',)
+    search_fields = ('email', 'first_name', 'last_name')
+    autocomplete_fields = ('user',)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    pass
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'categories', 'sizes', 'price', 'price_with_discount', 'effective_price')
+    # categories leads product_facets_idx
+    list_filter = ('categories',)
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    pass
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('transaction_id', 'user', 'date_ordered', 'ordered', 'items', 'order_total')
+    list_select_related = ('user',)
+    # no date_hierarchy, its links scan the dates of the whole table on every visit
+    list_filter = ('ordered', 'date_ordered')
+    search_fields = ('=transaction_id', 'user__username')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('products',)
+
+    def get_changelist(self, request, **kwargs):
+        return OrderChangeList
+
+    # sorted by the stored totals, which need no join
+    @admin.display(description='items', ordering='items_count')
+    def items(self, order):
+        return order.computed_items_count
+
+    @admin.display(description='total', ordering='total')
+    def order_total(self, order):
+        return round(order.get_total_cart(), 2)
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
-    pass
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'user', 'quantity', 'ordered', 'date_added')
+    list_select_related = ('product', 'user')
+    list_filter = ('ordered', 'date_added')
+    search_fields = ('product__name', 'user__username')
+    autocomplete_fields = ('product', 'user')
 
 
 @admin.register(ShippingAddress)
-class ShippingAddressAdmin(admin.ModelAdmin):
-    pass
+class ShippingAddressAdmin(LargeTableAdmin):
+    list_display = ('first_name', 'last_name', 'city', 'order', 'date_added')
+    list_select_related = ('order',)
+    list_filter = ('date_added',)
+    search_fields = ('email', 'last_name', 'order__transaction_id')
+    autocomplete_fields = ('product',)
+    raw_id_fields = ('order',)
 
 
 @admin.register(Contact)
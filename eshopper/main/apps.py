@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'eshopper.main'
+
+    def ready(self):
+        import eshopper.main.signals  # noqa: F401
@@ -0,0 +1,141 @@
+"""
+The psycopg2 backend with a connection pool per process and database. Django still connects
+and closes once per request, the pool turns that into a check out and a check in. Configured
+with a ``POOL`` entry next to the other keys of the database settings:
+
+    'POOL': {'MAX_SIZE': 10, 'TIMEOUT': 5, 'CHECK_AFTER': 30, 'MAX_LIFETIME': 3600}
+
+``CONN_MAX_AGE`` should stay 0, a connection Django kept open would never return to the pool.
+"""
+import os
+import threading
+from functools import partial
+
+from django.db.backends.postgresql import base, creation
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+from eshopper.main.pool import (
+    DEFAULT_CHECK_AFTER,
+    DEFAULT_MAX_LIFETIME,
+    DEFAULT_MAX_SIZE,
+    DEFAULT_TIMEOUT,
+    ConnectionPool,
+    PoolTimeout,
+)
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+# connections inherited by a forked worker share their sockets with the parent; they are kept
+# referenced so that the child never closes them under the parent's feet
+_inherited_connections = []
+
+
+def _reset_after_fork():
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        _inherited_connections.extend(connection for connection, _, _ in pool._idle)
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def check_connection(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset_connection(connection):
+    """Roll back what the last user left open; broken connections are not reused."""
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != TRANSACTION_STATUS_IDLE:
+        try:
+            connection.rollback()
+        except Database.Error:
+            return False
+    return True
+
+
+def close_connection(connection):
+    if not connection.closed:
+        connection.close()
+
+
+def get_pool(key, options):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(
+                check=check_connection,
+                reset=reset_connection,
+                close=close_connection,
+                max_size=options.get('MAX_SIZE', DEFAULT_MAX_SIZE),
+                timeout=options.get('TIMEOUT', DEFAULT_TIMEOUT),
+                check_after=options.get('CHECK_AFTER', DEFAULT_CHECK_AFTER),
+                max_lifetime=options.get('MAX_LIFETIME', DEFAULT_MAX_LIFETIME),
+            )
+        return pool
+
+
+def get_pool_stats():
+    """Counters of the pools of this process by alias and database name."""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {f'{key[0]}:{key[1]}': pool.get_stats() for key, pool in pools}
+
+
+def close_pools(database_name=None):
+    """Close the idle connections of every pool, or of the pools of ``database_name``."""
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if database_name is None or key[1] == database_name]
+    for pool in pools:
+        pool.close_idle()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections to the test database would keep it from being dropped
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        # test database creation connects under the same alias to another database
+        key = (
+            self.alias,
+            conn_params.get('database'),
+            conn_params.get('host'),
+            conn_params.get('port'),
+            conn_params.get('user'),
+        )
+        return get_pool(key, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection = self.get_pool(conn_params).acquire(partial(super().get_new_connection, conn_params))
+        except PoolTimeout as error:
+            raise Database.OperationalError(str(error)) from error
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool(self.get_connection_params()).release(self.connection)
@@ -0,0 +1,197 @@
+import copy
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from eshopper.main.models import Product
+
+
+def get_category_version(category):
+    """Return the current cache version of a category, starting a new one if there is none."""
+    key = f'category_version:{category}'
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_category(category):
+    cache.set(f'category_version:{category}', uuid.uuid4().hex, None)
+
+
+def get_category_grid_key(category, cursor):
+    # cursors come from the query string, hashing keeps the keys short and their length fixed
+    cursor_hash = hashlib.md5(cursor.encode()).hexdigest()
+    return f'category_grid:{category}:{get_category_version(category)}:{cursor_hash}'
+
+
+def get_cached_category_grid(category, cursor):
+    """The rendered grid and the ids of the products on it, or None."""
+    return cache.get(get_category_grid_key(category, cursor))
+
+
+def set_cached_category_grid(category, cursor, html, product_ids):
+    cache.set(
+        get_category_grid_key(category, cursor),
+        {'html': html, 'product_ids': product_ids},
+        settings.CATEGORY_CACHE_TIMEOUT,
+    )
+
+
+class LRUCache:
+    """A small thread safe in-process LRU mapping."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_products = LRUCache(settings.PRODUCT_CACHE_SIZE)
+product_cache_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def count_product_lookup(outcome):
+    with _stats_lock:
+        product_cache_stats[outcome] += 1
+
+
+def get_product_cache_stats():
+    """Lookups of this process: served from memory, from the shared cache or from the database."""
+    with _stats_lock:
+        stats = dict(product_cache_stats)
+    stats['hits'] = stats['local_hits'] + stats['shared_hits']
+    return stats
+
+
+def get_product_version(slug):
+    key = f'product_version:{slug}'
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_product(*slugs):
+    cache.set_many({f'product_version:{slug}': uuid.uuid4().hex for slug in slugs}, None)
+
+
+def get_product(slug):
+    """
+    Return the product with ``slug`` or None. The in-process LRU answers as long as the shared
+    version of the slug is unchanged, then the configured cache, and only then the database.
+    Every instance handed out is a copy, so callers may change it freely.
+    """
+    version = get_product_version(slug)
+    entry = local_products.get(slug)
+    if entry is not None and entry[0] == version:
+        count_product_lookup('local_hits')
+        return copy.copy(entry[1])
+
+    key = f'product:{slug}:{version}'
+    product = cache.get(key)
+    if product is not None:
+        count_product_lookup('shared_hits')
+    else:
+        count_product_lookup('misses')
+        # from the primary, a lagging replica would cache the product as it was before the change
+        product = Product.objects.using(DEFAULT_DB_ALIAS).filter(slug=slug).first()
+        if product is None:
+            return None
+        cache.set(key, product, settings.PRODUCT_CACHE_TIMEOUT)
+    local_products.set(slug, (version, product))
+    return copy.copy(product)
+
+
+# pages with a text search depend on the words of every product
+SEARCH_SURROGATE_KEY = 'search'
+
+
+def product_surrogate_key(pk):
+    return f'product:{pk}'
+
+
+def category_surrogate_key(category):
+    return f'category:{category}'
+
+
+def add_surrogate_keys(request, *keys):
+    """Tag the page being rendered; purging any of the keys drops it from the page cache."""
+    if not hasattr(request, 'surrogate_keys'):
+        request.surrogate_keys = set()
+    request.surrogate_keys.update(keys)
+
+
+def get_surrogate_versions(keys):
+    version_keys = {f'surrogate_version:{key}': key for key in keys}
+    versions = cache.get_many(version_keys)
+    missing = [version_key for version_key in version_keys if version_key not in versions]
+    if missing:
+        for version_key in missing:
+            cache.add(version_key, uuid.uuid4().hex, None)
+        versions.update(cache.get_many(missing))
+    return {version_keys[version_key]: version for version_key, version in versions.items()}
+
+
+def purge_surrogate_keys(*keys):
+    cache.set_many({f'surrogate_version:{key}': uuid.uuid4().hex for key in keys}, None)
+
+
+def get_page_key(request):
+    url = request.build_absolute_uri()
+    return f'page:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def get_cached_page(request):
+    """
+    A page is stored with the versions its surrogate keys had when it was rendered; it is served
+    only while all of them are unchanged.
+    """
+    page = cache.get(get_page_key(request))
+    if page is None or get_surrogate_versions(page['keys']) != page['versions']:
+        return None
+    return page
+
+
+def set_cached_page(request, content, headers, keys):
+    page = {
+        'content': content,
+        'headers': headers,
+        'keys': sorted(keys),
+        'versions': get_surrogate_versions(keys),
+    }
+    cache.set(get_page_key(request), page, settings.PAGE_CACHE_TIMEOUT)
+
+
+def anonymous_page_cache(view):
+    """Mark a view function or class whose pages may be served to anonymous visitors from the cache."""
+    view.anonymous_page_cache = True
+    return view
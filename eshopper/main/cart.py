@@ -0,0 +1,242 @@
+"""
+Cart mutations as short transactions of single-statement updates.
+
+Totals and quantities are changed with ``F()`` expressions, so concurrent clicks on the same
+cart never lose an update. Every mutation touches the open ``Order`` row first, which locks it
+for the rest of the transaction, and only then the order items, so two mutations of one cart
+always take their locks in the same order. Adding to or decreasing an item already in the cart
+takes two queries, adding a new line five. The unique open cart per user keeps concurrent
+first adds from opening two orders. A line keeps the price its product had when it was added,
+so a later price change cannot make the amounts added and taken out of the totals disagree.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Least
+
+from eshopper.main.models import Order, OrderItem, SHIPPING_RATE
+
+ITEM_ADDED = 'added'
+QUANTITY_UPDATED = 'updated'
+ITEM_REMOVED = 'removed'
+NOT_IN_CART = 'not_in_cart'
+NO_ACTIVE_ORDER = 'no_active_order'
+
+
+def get_unit_price(product):
+    return product.effective_price
+
+
+def get_open_orders(user):
+    return Order.objects.filter(user=user, ordered=False)
+
+
+def get_orders_containing(user, product):
+    return get_open_orders(user).filter(products__product=product, products__ordered=False)
+
+
+def get_cart_items(user, product):
+    return OrderItem.objects.filter(
+        user=user,
+        product=product,
+        ordered=False,
+        order__user=user,
+        order__ordered=False,
+    )
+
+
+def change_totals(orders, amount, items=0):
+    """Shift the stored totals of ``orders`` by ``amount`` and the item count by ``items``."""
+    sub_total = F('sub_total') + amount
+    changes = {
+        'sub_total': sub_total,
+        'shipping_price': sub_total * SHIPPING_RATE,
+        'total': sub_total + sub_total * SHIPPING_RATE,
+    }
+    if items:
+        changes['items_count'] = F('items_count') + items
+    return orders.update(**changes)
+
+
+def has_open_order(user):
+    return get_open_orders(user).exists()
+
+
+def get_cart_quantity(product, **filters):
+    """Quantity of the product in the order of the outer query."""
+    return Subquery(
+        OrderItem.objects.filter(
+            order=OuterRef('pk'),
+            product=product,
+            ordered=False,
+            **filters,
+        ).values('quantity')[:1]
+    )
+
+
+def get_cart_unit_price(product):
+    """Price the product was added at to the order of the outer query."""
+    return Coalesce(
+        Subquery(
+            OrderItem.objects.filter(
+                order=OuterRef('pk'),
+                product=product,
+                ordered=False,
+            ).values('unit_price')[:1]
+        ),
+        # lines added before the price was stored on them
+        Value(get_unit_price(product)),
+        output_field=FloatField(),
+    )
+
+
+def unlink_item(user, product):
+    Order.products.through.objects.filter(
+        order__user=user,
+        order__ordered=False,
+        orderitem__product=product,
+        orderitem__ordered=False,
+    ).delete()
+
+
+def lock_open_order(user, amount):
+    """
+    Add the amount of a new line to the user's cart, which locks it, and return a subquery of
+    its primary key and whether the cart was created. A missing cart is created with the line
+    already counted; the unique open cart per user turns a concurrent creation into an
+    IntegrityError, after which the other cart is used.
+    """
+    while True:
+        if change_totals(get_open_orders(user), amount, items=1):
+            return Subquery(get_open_orders(user).values('pk')), False
+        shipping_price = amount * SHIPPING_RATE
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    user=user,
+                    sub_total=amount,
+                    shipping_price=shipping_price,
+                    total=amount + shipping_price,
+                    items_count=1,
+                )
+        except IntegrityError:
+            continue
+        return order.pk, True
+
+
+def add_item(user, product, quantity=1):
+    added_amount = ExpressionWrapper(get_cart_unit_price(product) * quantity, output_field=FloatField())
+    with transaction.atomic():
+        if change_totals(get_orders_containing(user, product), added_amount):
+            get_cart_items(user, product).update(quantity=F('quantity') + quantity)
+            return QUANTITY_UPDATED
+
+        unit_price = get_unit_price(product)
+        order_pk, created = lock_open_order(user, unit_price * quantity)
+        if not created and get_cart_items(user, product).update(quantity=F('quantity') + quantity):
+            # a concurrent add created the line before the cart was locked: count it once, at
+            # the price it was added at
+            correction = ExpressionWrapper(
+                (get_cart_unit_price(product) - unit_price) * quantity,
+                output_field=FloatField(),
+            )
+            change_totals(get_open_orders(user), correction, items=-1)
+            return QUANTITY_UPDATED
+
+        order_item = OrderItem.objects.create(product=product, user=user, quantity=quantity, unit_price=unit_price)
+        Order.products.through.objects.create(order_id=order_pk, orderitem_id=order_item.pk)
+        return ITEM_ADDED
+
+
+def remove_item(user, product):
+    amount = ExpressionWrapper(
+        -get_cart_quantity(product) * get_cart_unit_price(product),
+        output_field=FloatField(),
+    )
+    with transaction.atomic():
+        if not change_totals(get_orders_containing(user, product), amount, items=-1):
+            return NOT_IN_CART if has_open_order(user) else NO_ACTIVE_ORDER
+        unlink_item(user, product)
+        return ITEM_REMOVED
+
+
+def decrease_item(user, product, quantity=1):
+    """Take ``quantity`` units out of the cart, removing the line when none are left."""
+    removed_units = Least(get_cart_quantity(product), quantity)
+    amount = ExpressionWrapper(-removed_units * get_cart_unit_price(product), output_field=FloatField())
+    # 1 when the last unit is taken out, so the line disappears from the item count
+    last_unit = Coalesce(
+        Subquery(
+            OrderItem.objects.filter(
+                order=OuterRef('pk'),
+                product=product,
+                ordered=False,
+                quantity__lte=quantity,
+            ).values('order').annotate(count=Count('pk')).values('count')[:1]
+        ),
+        0,
+    )
+    with transaction.atomic():
+        if not change_totals(get_orders_containing(user, product), amount, items=-last_unit):
+            return NOT_IN_CART if has_open_order(user) else NO_ACTIVE_ORDER
+        if get_cart_items(user, product).filter(quantity__gt=quantity).update(quantity=F('quantity') - quantity):
+            return QUANTITY_UPDATED
+        unlink_item(user, product)
+        return ITEM_REMOVED
+
+
+def remove_from_all_carts(product):
+    """Take a product that is being deleted out of every cart, a line without it cannot be bought."""
+    amount = ExpressionWrapper(
+        -get_cart_quantity(product) * get_cart_unit_price(product),
+        output_field=FloatField(),
+    )
+    with transaction.atomic():
+        orders = Order.objects.filter(ordered=False, products__product=product, products__ordered=False)
+        change_totals(orders, amount, items=-1)
+        OrderItem.objects.filter(product=product, ordered=False).delete()
+
+
+def change_quantity(user, product, delta):
+    """Add a positive ``delta``, take out a negative one, or remove the line when it is None."""
+    if delta is None:
+        return remove_item(user, product)
+    if delta > 0:
+        return add_item(user, product, delta)
+    return decrease_item(user, product, -delta)
+
+
+def apply_changes(user, changes):
+    """Apply ``(product, delta)`` pairs in one transaction and return the result of each."""
+    with transaction.atomic():
+        return [change_quantity(user, product, delta) for product, delta in changes]
+
+
+def serialize_cart(order):
+    if not order:
+        return {
+            'items': [],
+            'items_count': 0,
+            'sub_total': 0,
+            'shipping_price': 0,
+            'total': 0,
+        }
+    items = []
+    for order_item in order.products.all():
+        product = order_item.product
+        unit_price = order_item.get_unit_price()
+        items.append({
+            # a line whose product was deleted can only be checked out, which drops it
+            'slug': product.slug if product else None,
+            'name': product.name if product else order_item.product_name,
+            'available': product is not None,
+            'quantity': order_item.quantity,
+            'unit_price': unit_price,
+            'total': unit_price * order_item.quantity,
+        })
+    return {
+        'items': items,
+        'items_count': order.items_count,
+        'sub_total': order.sub_total,
+        'shipping_price': order.shipping_price,
+        'total': order.total,
+    }
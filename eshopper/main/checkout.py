@@ -0,0 +1,74 @@
+"""
+Checkout as one short transaction: lock the cart row, fix the prices and copy the names of its items,
+store the totals, close the order and its items and link the shipping address. Everything that
+can be done before, such as validating the address, is done outside of it, so the lock is held
+for a handful of statements. A retried submission carrying the same idempotency key gets the
+order that was already placed instead of an error or a second order.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from eshopper.main.cart import get_open_orders
+from eshopper.main.models import Order, OrderItem, SHIPPING_RATE
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def get_placed_order(user, idempotency_key):
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=user, ordered=True, idempotency_key=idempotency_key).first()
+
+
+def place_order(user, shipping_address, idempotency_key=None):
+    """Close the user's cart as an order shipped to the unsaved ``shipping_address``."""
+    order = get_placed_order(user, idempotency_key)
+    if order is not None:
+        return order
+
+    with transaction.atomic():
+        order = get_open_orders(user).select_for_update().first()
+        if order is None:
+            # a concurrent retry may have placed it while this one waited for the lock
+            order = get_placed_order(user, idempotency_key)
+            if order is not None:
+                return order
+            raise CheckoutError('You do not have an active order')
+
+        items = list(
+            OrderItem.objects
+                .filter(order=order)
+                .select_related('product')
+                .only('pk', 'quantity', 'unit_price', 'product__name', 'product__effective_price')
+        )
+        unavailable = [item.pk for item in items if item.product is None]
+        if unavailable:
+            # their product was deleted, so they can neither be bought nor removed on the cart page
+            OrderItem.objects.filter(pk__in=unavailable).delete()
+            items = [item for item in items if item.product is not None]
+        if not items:
+            raise CheckoutError('Your cart is empty')
+
+        sub_total = 0
+        for item in items:
+            # the cart was totalled with the prices the lines were added at
+            item.unit_price = item.get_unit_price()
+            item.product_name = item.product.name or ''
+            item.ordered = True
+            sub_total += item.quantity * item.unit_price
+        OrderItem.objects.bulk_update(items, ['unit_price', 'product_name', 'ordered'])
+
+        order.sub_total = sub_total
+        order.shipping_price = sub_total * SHIPPING_RATE
+        order.total = sub_total + order.shipping_price
+        order.items_count = len(items)
+        order.ordered = True
+        order.date_ordered = timezone.now()
+        order.idempotency_key = idempotency_key or None
+        order.save(update_fields=[*Order.TOTAL_FIELDS, 'ordered', 'date_ordered', 'idempotency_key'])
+
+        shipping_address.order = order
+        shipping_address.save()
+    return order
@@ -0,0 +1,86 @@
+"""
+Conditional GET for the catalog pages. The validators come from ``MAX(updated_at)`` over the
+category a page shows, read from an index, so a repeat visit is answered with a 304 before any
+template is rendered. ``updated_at`` cannot see a product leave the category, by deletion or by
+moving to another one, so the signals keep the time of the last such removal per category and
+it takes part in both validators.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+ALL_CATEGORIES = '*'
+
+
+def get_removed_at_key(category):
+    return f'product_removed_at:{category}'
+
+
+def record_listing_removal(categories):
+    """Remember that products left ``categories``, which their ``MAX(updated_at)`` cannot show."""
+    now = timezone.now()
+    cache.set_many({get_removed_at_key(category): now for category in (*categories, ALL_CATEGORIES)}, None)
+
+
+def get_removed_at(category):
+    key = get_removed_at_key(category)
+    removed_at = cache.get(key)
+    if removed_at is None:
+        # an evicted timestamp may have hidden a removal, so count it as one that just happened
+        cache.add(key, timezone.now(), None)
+        removed_at = cache.get(key)
+    return removed_at
+
+
+def get_validators(request, products, category=ALL_CATEGORIES):
+    """ETag and Last-Modified timestamp of the page showing ``products`` to this visitor."""
+    last_modified = products.aggregate(last_modified=Max('updated_at'))['last_modified']
+    removed_at = get_removed_at(category)
+    if removed_at is not None and (last_modified is None or removed_at > last_modified):
+        last_modified = removed_at
+
+    parts = [request.get_full_path(), last_modified and last_modified.isoformat()]
+    if request.user.is_authenticated:
+        # signed in pages show the cart; their Last-Modified would miss cart changes
+        order = request.cart
+        parts += [request.user.pk, order.items_count if order else None, order.total if order else None]
+        last_modified = None
+    etag = hashlib.md5(repr(parts).encode()).hexdigest()
+    return etag, last_modified and int(last_modified.timestamp())
+
+
+def conditional_catalog_page(get_products):
+    """
+    Answer conditional GETs of a catalog view. ``get_products(request, *args, **kwargs)``
+    returns the products the page shows and their category (or None to render as usual).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # a pending message has to be rendered
+            if request.method not in ('GET', 'HEAD') or request.COOKIES.get('messages'):
+                return view(request, *args, **kwargs)
+            listing = get_products(request, *args, **kwargs)
+            if listing is None:
+                return view(request, *args, **kwargs)
+
+            products, category = listing
+            etag, last_modified = get_validators(request, products, category)
+            response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = quote_etag(etag)
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+                patch_cache_control(response, no_cache=True)
+                if request.user.is_authenticated:
+                    patch_cache_control(response, private=True)
+            return response
+        return wrapper
+    return decorator
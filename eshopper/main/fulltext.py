@@ -0,0 +1,164 @@
+"""
+Ranked full-text search over ``Product.name`` and ``Product.description``.
+
+PostgreSQL matches against an expression GIN index on the English ``tsvector`` of both columns,
+and a trigram GIN index on ``name`` catches misspelt names. SQLite keeps a copy of the two
+columns in an FTS5 table so search works in local development and tests. Other databases fall
+back to an unranked ``icontains`` scan.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'main_product_fts'
+# stays below the SQLite limit of bound parameters per statement
+REINDEX_BATCH_SIZE = 500
+# the columns copied into the FTS5 table
+INDEXED_FIELDS = ('name', 'description')
+
+PG_DOCUMENT = (
+    "to_tsvector('english'::regconfig, "
+    "COALESCE(\"main_product\".\"name\", '') || ' ' || \"main_product\".\"description\")"
+)
+PG_QUERY = "websearch_to_tsquery('english'::regconfig, %s)"
+
+PG_CREATE_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX IF NOT EXISTS product_search_document_idx ON main_product USING GIN "
+    "(to_tsvector('english'::regconfig, COALESCE(name, '') || ' ' || description))",
+    'CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON main_product USING GIN (name gin_trgm_ops)',
+)
+PG_DROP_SQL = (
+    'DROP INDEX IF EXISTS product_search_document_idx',
+    'DROP INDEX IF EXISTS product_name_trgm_idx',
+)
+
+SQLITE_CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, description, tokenize='porter unicode61')",
+)
+SQLITE_DROP_SQL = (
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def get_vendor(using):
+    return connections[using].vendor
+
+
+def create_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = PG_CREATE_SQL
+    elif vendor == 'sqlite':
+        statements = SQLITE_CREATE_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+    if vendor == 'sqlite':
+        rebuild_search_index(schema_editor.connection.alias)
+
+
+def drop_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'postgresql': PG_DROP_SQL, 'sqlite': SQLITE_DROP_SQL}.get(vendor, ())
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def rebuild_search_index(using='default'):
+    """Refill the FTS5 table from the product table; PostgreSQL indexes maintain themselves."""
+    if get_vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f"SELECT id, COALESCE(name, ''), description FROM main_product"
+        )
+
+
+def index_product(product, using='default'):
+    if get_vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.pk, product.name or '', product.description],
+        )
+
+
+def reindex_products(product_pks, using='default'):
+    """Copy the rows of ``product_pks`` again, after a bulk write changed their text."""
+    if get_vendor(using) != 'sqlite' or not product_pks:
+        return
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(product_pks), REINDEX_BATCH_SIZE):
+            batch = product_pks[start:start + REINDEX_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                f"SELECT id, COALESCE(name, ''), description FROM main_product WHERE id IN ({placeholders})",
+                batch,
+            )
+
+
+def unindex_product(product_pk, using='default'):
+    if get_vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_pk])
+
+
+def to_fts5_query(term):
+    """Quote every word so user input cannot inject FTS5 syntax, and match on prefixes."""
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def filter_matching(queryset, term):
+    vendor = get_vendor(queryset.db)
+    if vendor == 'postgresql':
+        condition = RawSQL(
+            f'({PG_DOCUMENT} @@ {PG_QUERY} OR "main_product"."name" %% %s)',
+            (term, term),
+            output_field=BooleanField(),
+        )
+        return queryset.filter(condition)
+    if vendor == 'sqlite':
+        match = to_fts5_query(term)
+        if not match:
+            return queryset.none()
+        condition = RawSQL(
+            f'"main_product"."id" IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+            (match,),
+            output_field=BooleanField(),
+        )
+        return queryset.filter(condition)
+    return queryset.filter(name__icontains=term)
+
+
+def annotate_relevance(queryset, term, name='relevance'):
+    """Annotate a relevance score where higher is better."""
+    vendor = get_vendor(queryset.db)
+    if vendor == 'postgresql':
+        relevance = RawSQL(
+            # similarity() is NULL for a NULL name, and the keyset pagination needs a value
+            f'(ts_rank({PG_DOCUMENT}, {PG_QUERY}) + COALESCE(similarity("main_product"."name", %s), 0))::float8',
+            (term, term),
+            output_field=FloatField(),
+        )
+    elif vendor == 'sqlite':
+        relevance = RawSQL(
+            f'COALESCE((SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = "main_product"."id"), 0)',
+            (to_fts5_query(term),),
+            output_field=FloatField(),
+        )
+    else:
+        relevance = Value(0.0, output_field=FloatField())
+    return queryset.annotate(**{name: relevance})
@@ -0,0 +1,69 @@
+"""
+ULID style identifiers: 48 bits of millisecond timestamp followed by 80 random bits, written as
+26 characters of Crockford base32. They sort by creation time, so new rows are appended at
+the right edge of a B-tree index instead of landing on random pages, and the random part makes
+collisions between processes and nodes practically impossible without any coordination.
+Within one process identifiers generated in the same millisecond increase strictly.
+"""
+import os
+import threading
+import time
+
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+TIMESTAMP_BITS = 48
+RANDOM_BITS = 80
+LENGTH = 26
+
+_lock = threading.Lock()
+_last_timestamp = -1
+_last_random = 0
+
+
+def _reset_after_fork():
+    global _lock, _last_timestamp, _last_random
+    # a forked worker must not continue the sequence of its parent
+    _lock = threading.Lock()
+    _last_timestamp = -1
+    _last_random = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def encode(value):
+    characters = []
+    for _ in range(LENGTH):
+        value, index = divmod(value, 32)
+        characters.append(ENCODING[index])
+    return ''.join(reversed(characters))
+
+
+def decode_timestamp(ulid):
+    """Milliseconds since the epoch at which ``ulid`` was generated."""
+    value = 0
+    for character in ulid:
+        value = value * 32 + ENCODING.index(character)
+    return value >> RANDOM_BITS
+
+
+def new_ulid(timestamp_ms=None):
+    global _last_timestamp, _last_random
+    if timestamp_ms is not None:
+        random_part = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+        return encode((timestamp_ms << RANDOM_BITS) | random_part)
+
+    with _lock:
+        timestamp = time.time_ns() // 1_000_000
+        if timestamp <= _last_timestamp:
+            # same millisecond (or the clock went back): keep increasing from the last value
+            timestamp = _last_timestamp
+            random_part = _last_random + 1
+            if random_part >> RANDOM_BITS:
+                timestamp += 1
+                random_part = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+        else:
+            random_part = int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+        _last_timestamp = timestamp
+        _last_random = random_part
+    return encode((timestamp << RANDOM_BITS) | random_part)
@@ -0,0 +1,93 @@
+"""
+Resized and WebP copies of product images.
+
+Every uploaded image gets a copy for each of ``VARIANT_WIDTHS`` that is narrower than the
+original, in the original format and as WebP, stored next to the uploads under
+``thumbnails/``. The widths that were generated are recorded on ``Product.image_variants`` so
+templates can build ``srcset`` attributes without touching the storage.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+VARIANT_WIDTHS = (100, 400, 800, 1200)
+VARIANTS_DIR = 'thumbnails'
+
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+FALLBACK_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+}
+
+
+def get_fallback_extension(name):
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    return extension if extension in FALLBACK_FORMATS else 'jpg'
+
+
+def get_variant_name(name, width, extension=None):
+    stem = os.path.splitext(name)[0]
+    if extension is None:
+        extension = get_fallback_extension(name)
+    return f'{VARIANTS_DIR}/{stem}-{width}w.{extension}'
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, image_format, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def save_variant(name, content, force):
+    if default_storage.exists(name):
+        if not force:
+            return
+        default_storage.delete(name)
+    default_storage.save(name, content)
+
+
+def generate_variants(name, force=False):
+    """Write the variants of the image stored under ``name`` and return their widths."""
+    with default_storage.open(name) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    extension = get_fallback_extension(name)
+    widths = []
+    for width in VARIANT_WIDTHS:
+        if width >= original.width:
+            break
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        save_variant(get_variant_name(name, width), encode(resized, FALLBACK_FORMATS[extension]), force)
+        save_variant(get_variant_name(name, width, 'webp'), encode(resized, 'WEBP'), force)
+        widths.append(width)
+    return widths
+
+
+def delete_variants(name):
+    for width in VARIANT_WIDTHS:
+        for variant in (get_variant_name(name, width), get_variant_name(name, width, 'webp')):
+            if default_storage.exists(variant):
+                default_storage.delete(variant)
+
+
+def get_srcset(name, widths, extension=None):
+    return ', '.join(
+        f'{default_storage.url(get_variant_name(name, width, extension))} {width}w'
+        for width in widths
+    )
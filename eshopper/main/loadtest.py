@@ -0,0 +1,199 @@
+"""
+Scenario based load test of the storefront. Workers drive the real URL conf through the test
+client, each signed in as its own benchmark user, and pick scenarios by weight: browsing the
+shop with filters, opening products, adding to the cart and checking out. Every request is timed
+and its queries counted, and the results can be compared with a stored baseline.
+"""
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from eshopper.main.models import Product
+from eshopper.main.queries import record_queries
+from eshopper.main.search import FACETS
+
+BENCHMARK_USERNAME = 'benchmark-{}'
+# mean queries per request may grow by this much before it counts as a regression; the
+# scenario mix is seeded, so the counts only move when the code does
+QUERY_SLACK = 0.5
+
+CHECKOUT_DATA = {
+    'first_name': 'Load',
+    'last_name': 'Test',
+    'email': 'load.test@example.com',
+    'mobile_phone': '0000000000',
+    'address': 'Benchmark street 1',
+    'country': 'BG',
+    'city': 'Sofia',
+    'zip_code': '1000',
+}
+
+
+def get_host():
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+    return hosts[0] if hosts else 'localhost'
+
+
+class Session:
+    """One worker: a signed in client, an anonymous one and the catalog to pick from."""
+
+    def __init__(self, user, slugs, rng, record):
+        self.client = Client(HTTP_HOST=get_host(), raise_request_exception=False)
+        self.client.force_login(user)
+        self.anonymous = Client(HTTP_HOST=get_host(), raise_request_exception=False)
+        self.slugs = slugs
+        self.rng = rng
+        self.record = record
+
+    def request(self, step, client, method, url, data=None):
+        with record_queries() as recorder:
+            started = time.perf_counter()
+            try:
+                response = getattr(client, method)(url, data)
+                failed = response.status_code >= 500
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - started
+        self.record((step, elapsed, recorder.count, failed))
+
+    def browse(self):
+        params = {}
+        for facet in self.rng.sample(FACETS, self.rng.randint(0, len(FACETS))):
+            params[facet.param] = self.rng.choice(facet.options)[0]
+        self.request('shop', self.anonymous, 'get', reverse('shop'), params)
+        category = self.rng.choice(Product.CATEGORIES)[0]
+        self.request('shop_category', self.anonymous, 'get', reverse('shop_category', args=[category]))
+
+    def view_product(self):
+        slug = self.rng.choice(self.slugs)
+        self.request('product_details', self.client, 'get', reverse('product_details', args=[slug]))
+
+    def add_to_cart(self):
+        slug = self.rng.choice(self.slugs)
+        self.request('add_to_cart', self.client, 'get', reverse('add_to_cart', args=[slug]))
+        self.request('cart', self.client, 'get', reverse('cart'))
+
+    def check_out(self):
+        self.add_to_cart()
+        self.request('checkout', self.client, 'get', reverse('checkout'))
+        self.request('checkout_submit', self.client, 'post', reverse('checkout'), CHECKOUT_DATA)
+
+
+SCENARIOS = (
+    (Session.browse, 4),
+    (Session.view_product, 3),
+    (Session.add_to_cart, 2),
+    (Session.check_out, 1),
+)
+
+
+def get_benchmark_user(index):
+    user, _ = get_user_model().objects.get_or_create(username=BENCHMARK_USERNAME.format(index))
+    return user
+
+
+def run_worker(index, iterations, slugs, seed, record):
+    rng = random.Random(seed + index)
+    try:
+        session = Session(get_benchmark_user(index), slugs, rng, record)
+        scenarios, weights = zip(*SCENARIOS)
+        for _ in range(iterations):
+            rng.choices(scenarios, weights)[0](session)
+    finally:
+        connection.close()
+
+
+def run(concurrency=4, iterations=200, seed=1):
+    """Run ``iterations`` scenarios spread over ``concurrency`` workers and summarise them."""
+    slugs = list(Product.objects.order_by('pk').values_list('slug', flat=True)[:1000])
+    if not slugs:
+        raise ValueError('There are no products to benchmark against, load a catalog first')
+
+    samples = []
+    lock = threading.Lock()
+
+    def record(sample):
+        with lock:
+            samples.append(sample)
+
+    per_worker = [iterations // concurrency + (index < iterations % concurrency) for index in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_worker, index, count, slugs, seed, record)
+            for index, count in enumerate(per_worker)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    results = {
+        'meta': {
+            'database': connections['default'].vendor,
+            'concurrency': concurrency,
+            'iterations': iterations,
+            'seed': seed,
+            'products': len(slugs),
+        },
+        'total': summarise(samples),
+        'steps': {},
+    }
+    results['total']['throughput'] = round(len(samples) / elapsed, 1) if elapsed else 0
+    steps = defaultdict(list)
+    for sample in samples:
+        steps[sample[0]].append(sample)
+    for step, step_samples in sorted(steps.items()):
+        results['steps'][step] = summarise(step_samples)
+    return results
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarise(samples):
+    durations = sorted(sample[1] * 1000 for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[3]),
+        'p50': round(percentile(durations, 0.50), 2),
+        'p95': round(percentile(durations, 0.95), 2),
+        'p99': round(percentile(durations, 0.99), 2),
+        'queries_per_request': round(sum(sample[2] for sample in samples) / len(samples), 2) if samples else 0,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Regressions of ``results`` against ``baseline``: slower p95, more queries or new errors."""
+    regressions = []
+    sections = [('total', results['total'], baseline.get('total'))]
+    sections += [
+        (step, summary, baseline.get('steps', {}).get(step))
+        for step, summary in results['steps'].items()
+    ]
+    for name, summary, previous in sections:
+        if previous is None:
+            continue
+        if summary['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {summary["p95"]} ms, baseline {previous["p95"]} ms')
+        if summary['queries_per_request'] > previous['queries_per_request'] + QUERY_SLACK:
+            regressions.append(
+                f'{name}: {summary["queries_per_request"]} queries per request, '
+                f'baseline {previous["queries_per_request"]}'
+            )
+        if summary['errors'] > previous['errors']:
+            regressions.append(f'{name}: {summary["errors"]} errors, baseline {previous["errors"]}')
+    return regressions
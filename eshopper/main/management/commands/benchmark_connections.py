@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+from eshopper.main.loadtest import percentile
+
+ENGINES = (
+    ('plain', 'django.db.backends.postgresql'),
+    ('pooled', 'eshopper.main.backends.postgresql_pool'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of short requests against PostgreSQL with and without the connection pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Simulated requests per backend',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Threads running requests at the same time',
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=3,
+            help='Queries per request, about what the cheap catalog pages run',
+        )
+        parser.add_argument(
+            '--pool-size',
+            type=int,
+            help='Overrides MAX_SIZE of the pool; below --concurrency it shows the waits',
+        )
+
+    def handle(self, *args, **options):
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        if connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+            raise CommandError('The connection benchmark needs PostgreSQL as the default database')
+
+        pool = dict(settings_dict.get('POOL', {}))
+        if options['pool_size']:
+            pool['MAX_SIZE'] = options['pool_size']
+
+        self.stdout.write(f'{"backend":<10}{"requests":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"req/s":>9}')
+        for name, engine in ENGINES:
+            backend_settings = {**settings_dict, 'ENGINE': engine, 'POOL': pool, 'CONN_MAX_AGE': 0}
+            durations, elapsed, stats = self.run(backend_settings, options)
+            durations.sort()
+            self.stdout.write(
+                f'{name:<10}{len(durations):>9}{percentile(durations, 0.50):>9.2f}'
+                f'{percentile(durations, 0.95):>9.2f}{percentile(durations, 0.99):>9.2f}'
+                f'{len(durations) / elapsed:>9.1f}'
+            )
+            if stats:
+                self.stdout.write('  pool: ' + ', '.join(f'{key} {value}' for key, value in stats.items()))
+
+    @staticmethod
+    def run(settings_dict, options):
+        """Time connect, ``--queries`` statements and close, the database work of one request."""
+        backend = load_backend(settings_dict['ENGINE'])
+        alias = f'benchmark-{settings_dict["ENGINE"]}'
+        durations = []
+        lock = threading.Lock()
+
+        def work(count):
+            connection = backend.DatabaseWrapper(settings_dict, alias)
+            for _ in range(count):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    for _ in range(options['queries']):
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                connection.close()
+                with lock:
+                    durations.append((time.perf_counter() - started) * 1000)
+
+        concurrency = options['concurrency']
+        per_worker = [
+            options['requests'] // concurrency + (index < options['requests'] % concurrency)
+            for index in range(concurrency)
+        ]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(work, count) for count in per_worker]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        stats = {}
+        if hasattr(backend, 'get_pool_stats'):
+            stats = {
+                key: value
+                for name, pool_stats in backend.get_pool_stats().items() if name.startswith(alias)
+                for key, value in pool_stats.items()
+            }
+            backend.close_pools(settings_dict['NAME'])
+        return durations, elapsed, stats
@@ -0,0 +1,89 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from eshopper.main import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Load test the storefront with mixed scenarios and compare the results with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Workers running scenarios at the same time',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Scenarios to run in total',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Seed of the scenario mix',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this file',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON results of an earlier run; a regression against them fails the command',
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Write the results to the --baseline file instead of comparing with it',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Fraction by which a p95 latency may exceed the baseline',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            results = loadtest.run(options['concurrency'], options['iterations'], options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        self.report(results)
+        if options['output']:
+            self.write(options['output'], results)
+
+        if not options['baseline']:
+            return
+        if options['save_baseline']:
+            self.write(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline to {options["baseline"]}'))
+            return
+
+        with open(options['baseline']) as file:
+            baseline = json.load(file)
+        regressions = loadtest.compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Performance regressed:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def report(self, results):
+        total = results['total']
+        self.stdout.write(
+            f'{total["requests"]} requests, {total["errors"]} errors, {total["throughput"]} requests/s'
+        )
+        self.stdout.write(f'{"step":<18}{"requests":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}')
+        for step, summary in [*results['steps'].items(), ('total', total)]:
+            self.stdout.write(
+                f'{step:<18}{summary["requests"]:>9}{summary["p50"]:>9}{summary["p95"]:>9}'
+                f'{summary["p99"]:>9}{summary["queries_per_request"]:>9}'
+            )
+
+    @staticmethod
+    def write(path, results):
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
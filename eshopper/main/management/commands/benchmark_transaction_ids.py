@@ -0,0 +1,66 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from eshopper.main.models import Order, default_random_transaction_id, generate_transaction_id
+
+SCHEMES = {
+    'random': default_random_transaction_id,
+    'ulid': generate_transaction_id,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput and index locality of the transaction id schemes (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--orders',
+            type=int,
+            default=2000,
+            help='Orders to insert per scheme',
+        )
+
+    def handle(self, *args, **options):
+        for name, generate in SCHEMES.items():
+            with transaction.atomic():
+                result = self.run_scheme(generate, options['orders'])
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f'{name:>6}: {result["inserted"]} inserted, {result["collisions"]} collisions, '
+                f'{result["rate"]:.0f} orders/s, {result["appended"]:.1%} appended at the index edge'
+            )
+
+    def run_scheme(self, generate, count):
+        user = get_user_model().objects.create(username=f'benchmark-{time.monotonic_ns()}')
+        # start from the keys already in the table so both schemes see the same index
+        keys = list(Order.objects.exclude(transaction_id=None).values_list('transaction_id', flat=True))
+        highest = max(keys, default='')
+        inserted = collisions = appended = 0
+
+        started = time.perf_counter()
+        for _ in range(count):
+            transaction_id = str(generate())
+            try:
+                with transaction.atomic():
+                    # placed orders, a user may only have one open cart
+                    Order.objects.create(user=user, transaction_id=transaction_id, ordered=True)
+            except IntegrityError:
+                collisions += 1
+                continue
+            inserted += 1
+            # a key above every existing one goes to the rightmost leaf page, anything else
+            # splits or dirties a page somewhere in the middle of the index
+            if transaction_id > highest:
+                appended += 1
+                highest = transaction_id
+        elapsed = time.perf_counter() - started
+
+        return {
+            'inserted': inserted,
+            'collisions': collisions,
+            'rate': inserted / elapsed if elapsed else 0,
+            'appended': appended / inserted if inserted else 0,
+        }
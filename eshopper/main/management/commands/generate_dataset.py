@@ -0,0 +1,259 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from eshopper.main.caching import (
+    SEARCH_SURROGATE_KEY,
+    category_surrogate_key,
+    invalidate_category,
+    purge_surrogate_keys,
+)
+from eshopper.main.fulltext import rebuild_search_index
+from eshopper.main.ids import encode, RANDOM_BITS
+from eshopper.main.models import Customer, Order, OrderItem, Product, ShippingAddress, SHIPPING_RATE
+from eshopper.main.related import refresh_category
+
+ADJECTIVES = (
+    'Classic', 'Slim', 'Relaxed', 'Vintage', 'Linen', 'Cotton', 'Washed', 'Cropped', 'Oversized',
+    'Tailored', 'Striped', 'Floral', 'Quilted', 'Lightweight', 'Wool', 'Denim', 'Summer', 'Winter',
+)
+NOUNS = {
+    'dresses': ('Midi Dress', 'Maxi Dress', 'Wrap Dress', 'Shirt Dress', 'Slip Dress'),
+    'jeans': ('Straight Jeans', 'Skinny Jeans', 'Bootcut Jeans', 'Mom Jeans', 'Wide Leg Jeans'),
+    'jackets': ('Bomber Jacket', 'Denim Jacket', 'Parka', 'Blazer', 'Puffer Jacket'),
+    'shirts': ('Oxford Shirt', 'Polo Shirt', 'Flannel Shirt', 'T-Shirt', 'Henley'),
+}
+PRICE_RANGES = {
+    'dresses': (30, 250),
+    'jeans': (25, 180),
+    'jackets': (60, 450),
+    'shirts': (15, 120),
+}
+IMAGES = {
+    'dresses': ('blackdress.jpg', 'multicolordress.jpg', 'whitedress.jpg', 'yellowdress.jpg'),
+    'jeans': ('jeans.jpg',),
+    'jackets': ('jacket2.jpg',),
+    'shirts': ('darkblueshirt.jpg', 'pink.jpg'),
+}
+FIRST_NAMES = ('Maria', 'Ivan', 'Elena', 'Georgi', 'Anna', 'Peter', 'Sofia', 'Nikola', 'Laura', 'David')
+LAST_NAMES = ('Ivanova', 'Petrov', 'Smith', 'Garcia', 'Muller', 'Rossi', 'Novak', 'Dimitrov', 'Brown')
+CITIES = (('BG', 'Sofia'), ('BG', 'Plovdiv'), ('DE', 'Berlin'), ('FR', 'Lyon'), ('GB', 'Leeds'), ('US', 'Austin'))
+# transaction ids of generated orders count up from here, one millisecond apart
+FIRST_ORDER_TIMESTAMP_MS = 1_672_531_200_000
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded synthetic catalog with customers, open carts and completed orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=100_000,
+            help='Products to create',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10_000,
+            help='Users with a customer profile to create',
+        )
+        parser.add_argument(
+            '--max-orders',
+            type=int,
+            default=4,
+            help='Most completed orders per user',
+        )
+        parser.add_argument(
+            '--max-items',
+            type=int,
+            default=5,
+            help='Most order items per order',
+        )
+        parser.add_argument(
+            '--cart-ratio',
+            type=float,
+            default=0.3,
+            help='Share of users with an open cart',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Seed of the generator; the same seed on an empty database gives the same data',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per INSERT',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.options = options
+        started = time.perf_counter()
+
+        # primary keys are assigned here, so related rows can be linked without reading
+        # the generated ids back, which SQLite cannot return from a bulk insert
+        self.next_pk = {
+            model: (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            for model in (User, Product, Order, OrderItem)
+        }
+        self.order_number = Order.objects.count()
+
+        prices = self.create_products(options['products'])
+        counts = self.create_customers(options['users'], prices)
+        self.reset_sequences()
+        self.refresh_derived_data()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(prices)} products, {options["users"]} customers, {counts["orders"]} orders, '
+            f'{counts["items"]} order items and {counts["addresses"]} shipping addresses in {elapsed:.1f}s'
+        ))
+
+    def take_pk(self, model):
+        pk = self.next_pk[model]
+        self.next_pk[model] += 1
+        return pk
+
+    def create_products(self, count):
+        """Insert the products in batches and return their keys, names and effective prices."""
+        products = []
+        prices = []
+        for _ in range(count):
+            category = self.rng.choice(Product.CATEGORIES)[0]
+            low, high = PRICE_RANGES[category]
+            price = round(self.rng.uniform(low, high), 2)
+            # about a third of the catalog is on sale
+            discount = round(price * self.rng.uniform(0.6, 0.9), 2) if self.rng.random() < 0.3 else 0
+            pk = self.take_pk(Product)
+            name = f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS[category])}'
+            products.append(Product(
+                pk=pk,
+                name=name,
+                categories=category,
+                sizes=self.rng.choice(Product.SIZES)[0],
+                price=price,
+                price_with_discount=discount,
+                image=self.rng.choice(IMAGES[category]),
+                description=f'{name} from our {category} collection.',
+                slug=f'product-{pk}',
+            ))
+            prices.append((pk, name, discount or price))
+            if len(products) == self.batch_size:
+                Product.objects.bulk_create(products)
+                products = []
+        Product.objects.bulk_create(products)
+        return prices
+
+    def create_customers(self, count, prices):
+        password = make_password(None)
+        counts = {'orders': 0, 'items': 0, 'addresses': 0}
+        users_per_batch = max(1, self.batch_size // (self.options['max_orders'] * self.options['max_items'] + 1))
+        for first in range(0, count, users_per_batch):
+            rows = {model: [] for model in (User, Customer, OrderItem, Order, ShippingAddress)}
+            links = []
+            for _ in range(min(users_per_batch, count - first)):
+                self.add_customer(rows, links, password, prices)
+
+            with transaction.atomic():
+                for model, objs in rows.items():
+                    model.objects.bulk_create(objs, batch_size=self.batch_size)
+                Order.products.through.objects.bulk_create(links, batch_size=self.batch_size)
+            counts['orders'] += len(rows[Order])
+            counts['items'] += len(rows[OrderItem])
+            counts['addresses'] += len(rows[ShippingAddress])
+        return counts
+
+    def add_customer(self, rows, links, password, prices):
+        pk = self.take_pk(User)
+        first_name = self.rng.choice(FIRST_NAMES)
+        last_name = self.rng.choice(LAST_NAMES)
+        username = f'customer-{pk}'
+        user = User(pk=pk, username=username, password=password, first_name=first_name, last_name=last_name)
+        rows[User].append(user)
+        rows[Customer].append(Customer(
+            user_id=pk,
+            first_name=first_name,
+            last_name=last_name,
+            email=f'{username}@example.com',
+        ))
+
+        for _ in range(self.rng.randint(0, self.options['max_orders'])):
+            order = self.add_order(rows, links, user, prices, ordered=True)
+            country, city = self.rng.choice(CITIES)
+            rows[ShippingAddress].append(ShippingAddress(
+                order_id=order.pk,
+                first_name=first_name,
+                last_name=last_name,
+                email=f'{user.username}@example.com',
+                mobile_phone=f'+359{self.rng.randrange(10 ** 8, 10 ** 9)}',
+                address=f'{self.rng.randint(1, 200)} Main street',
+                country=country,
+                city=city,
+                zip_code=str(self.rng.randrange(1000, 99999)),
+            ))
+        if self.rng.random() < self.options['cart_ratio']:
+            self.add_order(rows, links, user, prices, ordered=False)
+
+    def add_order(self, rows, links, user, prices, ordered):
+        self.order_number += 1
+        transaction_id = encode(
+            ((FIRST_ORDER_TIMESTAMP_MS + self.order_number) << RANDOM_BITS) | self.rng.getrandbits(RANDOM_BITS)
+        )
+        order = Order(pk=self.take_pk(Order), user_id=user.pk, ordered=ordered, transaction_id=transaction_id)
+
+        sub_total = 0
+        count = min(len(prices), self.rng.randint(1, self.options['max_items']))
+        for product_pk, name, unit_price in self.rng.sample(prices, count):
+            quantity = self.rng.randint(1, 3)
+            item = OrderItem(
+                pk=self.take_pk(OrderItem),
+                product_id=product_pk,
+                user_id=user.pk,
+                quantity=quantity,
+                ordered=ordered,
+            )
+            if ordered:
+                # completed orders carry the price and name they were placed with
+                item.unit_price = unit_price
+                item.product_name = name
+            rows[OrderItem].append(item)
+            links.append(Order.products.through(order_id=order.pk, orderitem_id=item.pk))
+            sub_total += quantity * unit_price
+
+        order.sub_total = sub_total
+        order.shipping_price = sub_total * SHIPPING_RATE
+        order.total = sub_total + order.shipping_price
+        order.items_count = count
+        rows[Order].append(order)
+        return order
+
+    @staticmethod
+    def reset_sequences():
+        connection = connections[DEFAULT_DB_ALIAS]
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Product, Order, OrderItem])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    @staticmethod
+    def refresh_derived_data():
+        # bulk inserts skip the signals that keep these in step with the products
+        rebuild_search_index()
+        for category, _ in Product.CATEGORIES:
+            invalidate_category(category)
+            refresh_category(category)
+        purge_surrogate_keys(
+            SEARCH_SURROGATE_KEY,
+            *(category_surrogate_key(category) for category, _ in Product.CATEGORIES),
+        )
@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from eshopper.main.images import generate_variants
+from eshopper.main.models import Product
+
+
+def generate(name, force):
+    return name, generate_variants(name, force=force)
+
+
+class Command(BaseCommand):
+    help = 'Create the resized and WebP variants of product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants of every image, overwriting existing files',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes (default: number of CPUs)',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(image_variants=[])
+        names = set(products.values_list('image', flat=True))
+        if not names:
+            self.stdout.write('No images to process')
+            return
+
+        # the workers only touch the storage, they must not inherit open connections
+        connections.close_all()
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            futures = {executor.submit(generate, name, options['force']): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    name, widths = future.result()
+                except Exception as error:
+                    self.stderr.write(f'{futures[future]}: {error}')
+                    continue
+                Product.objects.filter(image=name).update(image_variants=widths)
+                done += 1
+                self.stdout.write(f'{name}: {", ".join(f"{width}w" for width in widths) or "kept original"}')
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {done} of {len(names)} images'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from eshopper.main.fulltext import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the SQLite full-text index of products, e.g. after bulk imports that skip signals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the index for',
+        )
+
+    def handle(self, *args, **options):
+        rebuild_search_index(options['database'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
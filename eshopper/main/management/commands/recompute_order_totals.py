@@ -0,0 +1,58 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from eshopper.main.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored cart totals of orders whose values have drifted from their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Check completed orders too, not only open carts',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the orders that would be repaired',
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if not options['all']:
+            orders = orders.filter(ordered=False)
+
+        checked = 0
+        repaired = 0
+        for order in self.iterate(orders.with_totals().order_by('pk')):
+            checked += 1
+            totals = order.calculate_totals()
+            # cart mutations shift the totals incrementally, rounding noise below a cent is fine
+            drifted = [
+                field for field in Order.TOTAL_FIELDS
+                if not math.isclose(getattr(order, field), totals[field], abs_tol=0.005)
+            ]
+            if not drifted:
+                continue
+
+            repaired += 1
+            self.stdout.write(f'Order {order.pk}: {", ".join(drifted)} drifted')
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Order.objects.filter(pk=order.pk).update(**totals)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} orders, repaired {repaired}'))
+
+    @staticmethod
+    def iterate(orders, batch_size=500):
+        last_pk = 0
+        while True:
+            batch = list(orders.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield from batch
+            last_pk = batch[-1].pk
@@ -0,0 +1,285 @@
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.static import was_modified_since
+
+from eshopper.main.caching import get_cached_page, set_cached_page
+from eshopper.main.models import Order, OrderItem
+from eshopper.main.queries import record_queries
+from eshopper.main.routers import PRIMARY_PIN_COOKIE, pick_read_database, read_from_primary, route_reads
+
+logger = logging.getLogger(__name__)
+
+
+def load_cart(user):
+    """Fetch the open order of the user with its items and their products in two queries."""
+    if not user.is_authenticated:
+        return None
+    order_items = OrderItem.objects.select_related('product')
+    return Order.objects.filter(
+        user=user,
+        ordered=False,
+    ).prefetch_related(
+        Prefetch('products', queryset=order_items),
+    ).first()
+
+
+def get_cart(request):
+    if not hasattr(request, '_cached_cart'):
+        request._cached_cart = load_cart(request.user)
+    return request._cached_cart
+
+
+def attach_cart(request):
+    """``request.cart``: the open order, loaded on first use; falsy when there is none."""
+    request.cart = SimpleLazyObject(lambda: get_cart(request))
+
+
+def reset_cart(request):
+    """Forget the cached cart after the request changed it, the next access loads it again."""
+    if hasattr(request, '_cached_cart'):
+        del request._cached_cart
+    attach_cart(request)
+
+
+class CartMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        attach_cart(request)
+        return self.get_response(request)
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Serve the catalog pages of anonymous visitors from the cache. Views opt in with
+    ``anonymous_page_cache`` and tag what they show with ``add_surrogate_keys``; signed in users,
+    visitors with a pending message and pages holding a CSRF token or setting cookies are
+    always rendered live.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, '_page_cache_miss', False) and self.can_store(request, response):
+            keys = getattr(request, 'surrogate_keys', set())
+            response['Surrogate-Key'] = ' '.join(sorted(keys))
+            headers = {name: value for name, value in response.items() if name.lower() != 'set-cookie'}
+            set_cached_page(request, response.content, headers, keys)
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', view_func)
+        if not getattr(view_class, 'anonymous_page_cache', False) or not self.is_anonymous(request):
+            return None
+        page = get_cached_page(request)
+        if page is None:
+            request._page_cache_miss = request.method == 'GET'
+            # the page is about to be cached, it must not be built from a lagging replica
+            read_from_primary()
+            return None
+        headers = page['headers']
+        response = get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=parse_http_date_safe(headers.get('Last-Modified', '')),
+        )
+        if response is None:
+            response = HttpResponse(page['content'], headers=headers)
+        else:
+            for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+                if header in headers:
+                    response[header] = headers[header]
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+    @staticmethod
+    def is_anonymous(request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+            and not request.COOKIES.get('messages')
+        )
+
+    @staticmethod
+    def can_store(request, response):
+        cache_control = response.get('Cache-Control', '')
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED')
+            and 'private' not in cache_control
+            and 'no-store' not in cache_control
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Let safe requests read the catalog from a replica, and pin clients that wrote to the
+    primary for ``PRIMARY_STICKY_SECONDS``. Sits outside the session middleware, so a session
+    saved on the way out counts as a write too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with route_reads(pick_read_database(request)) as state:
+            response = self.get_response(request)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE,
+                '1',
+                max_age=settings.PRIMARY_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Count the queries of every request, report them in a ``Server-Timing`` header and log the
+    requests that go over ``SLOW_REQUEST_QUERY_COUNT`` queries or ``SLOW_REQUEST_DB_MS`` of
+    database time, with the fingerprints of the repeated and the slowest statements.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = (
+                f'db;desc="{recorder.count} queries, {recorder.duplicates} duplicates";'
+                f'dur={recorder.duration * 1000:.1f}, total;dur={elapsed * 1000:.1f}'
+            )
+        if (
+            recorder.count > settings.SLOW_REQUEST_QUERY_COUNT
+            or recorder.duration * 1000 > settings.SLOW_REQUEST_DB_MS
+        ):
+            self.log_request(request, recorder)
+        return response
+
+    @staticmethod
+    def log_request(request, recorder):
+        lines = [
+            f'{request.method} {request.path}: {recorder.count} queries '
+            f'({recorder.duplicates} duplicates) in {recorder.duration * 1000:.1f} ms'
+        ]
+        for key, count in recorder.get_repeated_fingerprints()[:5]:
+            lines.append(f'  repeated {count}x: {key}')
+        for key, count, duration in recorder.get_slowest_fingerprints():
+            lines.append(f'  {duration * 1000:.1f} ms over {count}x: {key}')
+        logger.warning('\n'.join(lines))
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        # encoding -> (path, size) of the precompressed siblings
+        self.encodings = {}
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if os.path.exists(path + suffix):
+                self.encodings[encoding] = (path + suffix, os.path.getsize(path + suffix))
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the output of ``collectstatic`` from ``STATIC_ROOT`` without a separate web server or
+    CDN step. Content-hashed names are cached by clients for a year as immutable, and clients
+    get the brotli or gzip sibling written at build time when they accept it. The files are
+    indexed once at start-up; when nothing has been collected the middleware steps aside.
+    """
+    IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+    CACHE_CONTROL = 'public, max-age=60'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.files = self.scan(settings.STATIC_ROOT) if settings.STATIC_ROOT else {}
+
+    @staticmethod
+    def scan(root):
+        root = str(root)
+        manifest_path = os.path.join(root, 'staticfiles.json')
+        hashed_names = set()
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest:
+                hashed_names = set(json.load(manifest).get('paths', {}).values())
+
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')) or filename == 'staticfiles.json':
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                files[name] = StaticFile(path, immutable=name in hashed_names)
+        return files
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            static_file = self.files.get(request.path_info[len(self.prefix):])
+            if static_file is not None:
+                return self.serve(request, static_file)
+        return self.get_response(request)
+
+    @staticmethod
+    def get_accepted_encodings(request):
+        header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        accepted = set()
+        for part in header.split(','):
+            coding, _, params = part.strip().partition(';')
+            if re.search(r'q=0(\.0*)?$', params.replace(' ', '')):
+                continue
+            accepted.add(coding.strip().lower())
+        return accepted
+
+    def serve(self, request, static_file):
+        if not was_modified_since(
+                request.META.get('HTTP_IF_MODIFIED_SINCE'), static_file.mtime, static_file.size):
+            response = HttpResponseNotModified()
+        else:
+            path, size, encoding = static_file.path, static_file.size, None
+            accepted = self.get_accepted_encodings(request)
+            for candidate in ('br', 'gzip'):
+                if candidate in accepted and candidate in static_file.encodings:
+                    encoding = candidate
+                    path, size = static_file.encodings[candidate]
+                    break
+            response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+            response['Content-Length'] = size
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+        response['Last-Modified'] = http_date(static_file.mtime)
+        response['Cache-Control'] = \
+            self.IMMUTABLE_CACHE_CONTROL if static_file.immutable else self.CACHE_CONTROL
+        if static_file.encodings:
+            response['Vary'] = 'Accept-Encoding'
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    for order in Order.objects.prefetch_related('products__product'):
+        sub_total = 0
+        for order_item in order.products.all():
+            product = order_item.product
+            if product is None:
+                continue
+            unit_price = product.price_with_discount or product.price
+            sub_total += order_item.quantity * unit_price
+        order.sub_total = sub_total
+        order.shipping_price = sub_total * 0.01
+        order.total = order.sub_total + order.shipping_price
+        order.items_count = len(order.products.all())
+        order.save(update_fields=['sub_total', 'shipping_price', 'total', 'items_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_alter_product_categories'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='shipping_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='sub_total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
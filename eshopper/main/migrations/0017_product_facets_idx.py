@@ -0,0 +1,17 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['categories', 'sizes', 'price'], name='product_facets_idx'),
+        ),
+    ]
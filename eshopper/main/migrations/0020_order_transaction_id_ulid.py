@@ -0,0 +1,53 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:21
+
+import os
+
+from django.db import migrations, models
+import eshopper.main.models
+
+BATCH_SIZE = 500
+# a frozen copy of eshopper.main.ids, the migration must not change when the app code does
+ENCODING = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+RANDOM_BITS = 80
+LENGTH = 26
+
+
+def ulid_at(timestamp_ms):
+    value = (timestamp_ms << RANDOM_BITS) | int.from_bytes(os.urandom(RANDOM_BITS // 8), 'big')
+    characters = []
+    for _ in range(LENGTH):
+        value, index = divmod(value, 32)
+        characters.append(ENCODING[index])
+    return ''.join(reversed(characters))
+
+
+def backfill_transaction_ids(apps, schema_editor):
+    # existing ids come from randrange(1, 1000); replace them with ulids taken from the
+    # order date so the index stays in creation order
+    Order = apps.get_model('main', 'Order')
+    orders = Order.objects.using(schema_editor.connection.alias)
+    batch = []
+    for order in orders.only('pk', 'date_ordered').order_by('date_ordered', 'pk').iterator(chunk_size=BATCH_SIZE):
+        order.transaction_id = ulid_at(int(order.date_ordered.timestamp() * 1000))
+        batch.append(order)
+        if len(batch) == BATCH_SIZE:
+            orders.bulk_update(batch, ['transaction_id'])
+            batch = []
+    if batch:
+        orders.bulk_update(batch, ['transaction_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='transaction_id',
+            field=models.CharField(default=eshopper.main.models.generate_transaction_id, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_transaction_ids, migrations.RunPython.noop),
+    ]
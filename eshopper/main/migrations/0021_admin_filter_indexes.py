@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_order_transaction_id_ulid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_ordered'], name='order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered', 'date_ordered'], name='order_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['ordered', 'date_added'], name='orderitem_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shippingaddress',
+            index=models.Index(fields=['date_added'], name='shippingaddress_date_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    # the cart code always used the oldest open order, so the others are folded into it
+    Order = apps.get_model('main', 'Order')
+    users = (
+        Order.objects.filter(ordered=False)
+        .values('user').annotate(open_orders=Count('pk')).filter(open_orders__gt=1)
+        .values_list('user', flat=True)
+    )
+    for user in users:
+        kept, *duplicates = Order.objects.filter(user=user, ordered=False).order_by('pk')
+        for duplicate in duplicates:
+            for order_item in duplicate.products.all():
+                # a product in both carts becomes one line holding both quantities
+                existing = kept.products.filter(product=order_item.product_id).first()
+                if order_item.product_id is None or existing is None:
+                    kept.products.add(order_item)
+                    continue
+                existing.quantity = (existing.quantity or 0) + (order_item.quantity or 0)
+                existing.save(update_fields=['quantity'])
+                order_item.delete()
+            duplicate.delete()
+
+        sub_total = 0
+        for order_item in kept.products.select_related('product'):
+            product = order_item.product
+            if product is None:
+                continue
+            unit_price = product.price_with_discount or product.price
+            sub_total += order_item.quantity * unit_price
+        kept.sub_total = sub_total
+        kept.shipping_price = sub_total * 0.01
+        kept.total = kept.sub_total + kept.shipping_price
+        kept.items_count = kept.products.count()
+        kept.save(update_fields=['sub_total', 'shipping_price', 'total', 'items_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['user', 'product'], name='orderitem_open_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user',), name='order_one_open_cart_per_user'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:27
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def backfill_effective_price(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    Product.objects.using(schema_editor.connection.alias).update(
+        effective_price=Coalesce(NullIf(F('price_with_discount'), Value(0.0)), F('price'), output_field=FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_open_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_facets_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['categories', 'sizes', 'effective_price'], name='product_facets_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['categories', 'effective_price'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price'], name='product_price_idx'),
+        ),
+    ]
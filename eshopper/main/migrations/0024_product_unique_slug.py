@@ -0,0 +1,34 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_slugs(apps, schema_editor):
+    # the oldest product keeps the slug, the others get their primary key appended
+    Product = apps.get_model('main', 'Product')
+    duplicated = (
+        Product.objects.values('slug').annotate(products=Count('pk')).filter(products__gt=1)
+        .values_list('slug', flat=True)
+    )
+    for slug in duplicated:
+        for product in Product.objects.filter(slug=slug).order_by('pk')[1:]:
+            suffix = f'-{product.pk}'
+            product.slug = slug[:50 - len(suffix)] + suffix
+            product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
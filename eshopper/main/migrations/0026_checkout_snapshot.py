@@ -0,0 +1,42 @@
+# Generated by Django 3.2.13 on 2026-10-18 17:38
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def snapshot_ordered_items(apps, schema_editor):
+    # items ordered before this migration take the product's current price and name
+    OrderItem = apps.get_model('main', 'OrderItem')
+    Product = apps.get_model('main', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product'))
+    OrderItem.objects.using(schema_editor.connection.alias).filter(ordered=True, product__isnull=False).update(
+        unit_price=Subquery(product.values('effective_price')[:1]),
+        product_name=Coalesce(Subquery(product.values('name')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0025_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(snapshot_ordered_items, migrations.RunPython.noop),
+    ]
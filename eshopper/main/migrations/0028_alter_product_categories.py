@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_order_idempotency_key_per_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='categories',
+            field=models.CharField(choices=[('dresses', 'dresses'), ('jeans', 'jeans'), ('jackets', 'jackets'), ('shirts', 'shirts')], max_length=100),
+        ),
+    ]
@@ -1,16 +1,127 @@
 import random
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
 from django.urls import reverse
+from django.utils import timezone
 from django_countries.fields import CountryField
 
+from eshopper.main.fulltext import INDEXED_FIELDS, REINDEX_BATCH_SIZE, reindex_products
+from eshopper.main.ids import new_ulid
+
+
+SHIPPING_RATE = 0.01
+
 
 def default_random_transaction_id():
+    # superseded by generate_transaction_id, kept for the migrations that reference it
     rand_num = random.randrange(1, 1000)
     return rand_num
 
 
+def generate_transaction_id():
+    return new_ulid()
+
+
+def get_effective_price(price, price_with_discount):
+    """The price a product sells for; a discount of 0 means there is none. Accepts expressions."""
+    if not hasattr(price, 'resolve_expression') and not hasattr(price_with_discount, 'resolve_expression'):
+        return price_with_discount or price
+    price, price_with_discount = (
+        value if hasattr(value, 'resolve_expression') else Value(value, output_field=models.FloatField())
+        for value in (price, price_with_discount)
+    )
+    return Coalesce(NullIf(price_with_discount, Value(0.0)), price, output_field=models.FloatField())
+
+
+def record_listing_removals():
+    """A bulk write moved products between categories; which ones they left is not known."""
+    # conditional depends on the models
+    from eshopper.main.conditional import record_listing_removal
+
+    categories = [category for category, _ in Product.CATEGORIES]
+    transaction.on_commit(lambda: record_listing_removal(categories))
+
+
+def products_written(rows, listing_changed, using):
+    """
+    Invalidate the caches of products written in bulk, as the signals do for ``save()``. ``rows``
+    are the (pk, slug, category) of the products before and after the write.
+    """
+    # the signal handlers depend on the models
+    from eshopper.main.signals import invalidate_written_products
+
+    invalidate_written_products(rows, listing_changed, using)
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Keeps ``effective_price``, ``updated_at``, the SQLite search index and the caches in step on
+    writes that bypass ``save()``.
+    """
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        if 'price' in kwargs or 'price_with_discount' in kwargs:
+            # the right hand sides of one UPDATE see the old row, so use the new values directly
+            kwargs['effective_price'] = get_effective_price(
+                kwargs.get('price', F('price')),
+                kwargs.get('price_with_discount', F('price_with_discount')),
+            )
+        if 'categories' in kwargs:
+            record_listing_removals()
+        # the rows to invalidate and reindex, before the update can change what matches
+        rows = list(self.values_list('pk', 'slug', 'categories'))
+        updated = super().update(**kwargs)
+        if 'categories' in kwargs:
+            category = kwargs['categories']
+            new_categories = (
+                [name for name, _ in Product.CATEGORIES] if hasattr(category, 'resolve_expression') else [category]
+            )
+            rows += [(None, None, category) for category in new_categories]
+        products_written(rows, any(field in kwargs for field in Product.LISTING_FIELDS), self.db)
+        if any(field in kwargs for field in INDEXED_FIELDS):
+            reindex_products([pk for pk, _, _ in rows if pk is not None], using=self.db)
+        return updated
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        fields = list(fields)
+        if 'updated_at' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            fields.append('updated_at')
+        if ('price' in fields or 'price_with_discount' in fields) and 'effective_price' not in fields:
+            for obj in objs:
+                obj.effective_price = get_effective_price(obj.price, obj.price_with_discount)
+            fields.append('effective_price')
+        if 'categories' in fields:
+            record_listing_removals()
+        rows = [(obj.pk, obj.slug, obj.categories) for obj in objs]
+        if 'slug' in fields or 'categories' in fields:
+            # the slugs and categories the products leave
+            pks = [obj.pk for obj in objs]
+            for start in range(0, len(pks), REINDEX_BATCH_SIZE):
+                batch = pks[start:start + REINDEX_BATCH_SIZE]
+                rows += self.filter(pk__in=batch).values_list('pk', 'slug', 'categories')
+        updated = super().bulk_update(objs, fields, batch_size=batch_size)
+        products_written(rows, any(field in fields for field in Product.LISTING_FIELDS), self.db)
+        if any(field in fields for field in INDEXED_FIELDS):
+            reindex_products([obj.pk for obj in objs], using=self.db)
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.effective_price = get_effective_price(obj.price, obj.price_with_discount)
+        created = super().bulk_create(objs, *args, **kwargs)
+        products_written([(obj.pk, obj.slug, obj.categories) for obj in objs], True, self.db)
+        return created
+
+
 class Customer(models.Model):
     first_name = models.CharField(
         max_length=30,
@@ -71,6 +182,12 @@ class Product(models.Model):
         blank=True,
     )
 
+    # price_with_discount when there is one, otherwise price; listings filter and sort on it
+    effective_price = models.FloatField(
+        default=0,
+        editable=False,
+    )
+
     digital = models.BooleanField(
         default=False,
         null=True,
@@ -82,13 +199,60 @@ class Product(models.Model):
         blank=True,
     )
 
+    image_variants = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+    )
+
     description = models.TextField()
 
-    slug = models.SlugField()
+    slug = models.SlugField(
+        unique=True,
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+    )
+
+    objects = ProductQuerySet.as_manager()
+
+    TRACKED_FIELDS = ('categories', 'image', 'slug', 'sizes', 'effective_price')
+    # the fields that decide which listings show a product and in what order
+    LISTING_FIELDS = ('categories', 'sizes', 'effective_price')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['categories', 'sizes', 'effective_price'], name='product_facets_idx'),
+            models.Index(fields=['categories', 'effective_price'], name='product_category_price_idx'),
+            models.Index(fields=['effective_price'], name='product_price_idx'),
+            models.Index(fields=['categories', 'updated_at'], name='product_category_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.effective_price = get_effective_price(self.price, self.price_with_discount)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {*update_fields, 'updated_at'}
+            if {'price', 'price_with_discount'} & update_fields:
+                update_fields.add('effective_price')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so the signals can tell which category and slug the product left, whether
+        # a new image was uploaded and whether its place in the listings changed
+        instance._loaded_values = {
+            field: instance.__dict__.get(field) for field in cls.TRACKED_FIELDS
+        }
+        return instance
+
     def get_absolute_url(self):
         return reverse('product_details', kwargs={
             'slug': self.slug,
@@ -134,8 +298,30 @@ class OrderItem(models.Model):
         blank=False,
     )
 
+    # the price of the product when the line was added, kept when the order is placed
+    unit_price = models.FloatField(
+        null=True,
+        blank=True,
+    )
+
+    product_name = models.CharField(
+        max_length=100,
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ordered', 'date_added'], name='orderitem_status_date_idx'),
+            # the cart looks its lines up by user and product among the unordered items
+            models.Index(
+                fields=['user', 'product'],
+                condition=Q(ordered=False),
+                name='orderitem_open_idx',
+            ),
+        ]
+
     def __str__(self):
-        return self.product.name
+        return self.product_name or self.product.name
 
     def get_total_price(self):
         return self.quantity * self.product.price
@@ -143,13 +329,45 @@ class OrderItem(models.Model):
     def get_total_price_with_discount(self):
         return self.quantity * self.product.price_with_discount
 
+    def get_unit_price(self):
+        if self.unit_price is not None:
+            return self.unit_price
+        return self.product.effective_price
+
     def total_amount(self):
-        if self.product.price_with_discount:
-            return self.get_total_price_with_discount()
-        return self.get_total_price()
+        return self.quantity * self.get_unit_price()
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate the totals of every order in SQL, so listings need a single query."""
+        return self.annotate(
+            computed_sub_total=Coalesce(
+                Sum(
+                    F('products__quantity') * Coalesce(
+                        'products__unit_price',
+                        'products__product__effective_price',
+                    ),
+                    output_field=models.FloatField(),
+                ),
+                0.0,
+            ),
+            computed_items_count=Count('products'),
+        ).annotate(
+            computed_shipping_price=ExpressionWrapper(
+                F('computed_sub_total') * SHIPPING_RATE,
+                output_field=models.FloatField(),
+            ),
+            computed_total=ExpressionWrapper(
+                F('computed_sub_total') + F('computed_shipping_price'),
+                output_field=models.FloatField(),
+            ),
+        )
 
 
 class Order(models.Model):
+    TOTAL_FIELDS = ('sub_total', 'shipping_price', 'total', 'items_count')
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -172,27 +390,109 @@ class Order(models.Model):
     transaction_id = models.CharField(
         max_length=100,
         null=True,
-        default=default_random_transaction_id,
+        default=generate_transaction_id,
         unique=True,
     )
 
+    sub_total = models.FloatField(
+        default=0,
+    )
+
+    shipping_price = models.FloatField(
+        default=0,
+    )
+
+    total = models.FloatField(
+        default=0,
+    )
+
+    items_count = models.PositiveIntegerField(
+        default=0,
+    )
+
+    # sent with the checkout form, so a retried submission finds the order it already placed
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+    )
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_ordered'], name='order_date_idx'),
+            models.Index(fields=['ordered', 'date_ordered'], name='order_status_date_idx'),
+        ]
+        constraints = [
+            # a user has at most one cart; its unique index also serves the cart lookup
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=Q(ordered=False),
+                name='order_one_open_cart_per_user',
+            ),
+            # keys come from the client, so they are only unique among the orders of one user
+            models.UniqueConstraint(
+                fields=['user', 'idempotency_key'],
+                name='order_user_idempotency_key',
+            ),
+        ]
+
     def __str__(self):
         return self.transaction_id
 
     def get_sub_total(self):
+        if hasattr(self, 'computed_sub_total'):
+            return self.computed_sub_total
         total = 0
-        for order_item in self.products.all():
+        for order_item in self.products.select_related('product'):
             total += order_item.total_amount()
         return total
 
     def get_shipping_price(self):
-        shipping_price = self.get_sub_total() * 0.01
+        if hasattr(self, 'computed_shipping_price'):
+            return self.computed_shipping_price
+        shipping_price = self.get_sub_total() * SHIPPING_RATE
         return shipping_price
 
     def get_total_cart(self):
+        if hasattr(self, 'computed_total'):
+            return self.computed_total
         total = self.get_sub_total() + self.get_shipping_price()
         return total
 
+    def calculate_totals(self):
+        """Return the values of the stored totals, from with_totals() or by walking the items once."""
+        if hasattr(self, 'computed_sub_total'):
+            return {field: getattr(self, f'computed_{field}') for field in self.TOTAL_FIELDS}
+
+        if 'products' in getattr(self, '_prefetched_objects_cache', {}):
+            order_items = self.products.all()
+        else:
+            order_items = self.products.select_related('product')
+
+        sub_total = 0
+        items_count = 0
+        for order_item in order_items:
+            sub_total += order_item.total_amount()
+            items_count += 1
+        shipping_price = sub_total * SHIPPING_RATE
+        return {
+            'sub_total': sub_total,
+            'shipping_price': shipping_price,
+            'total': sub_total + shipping_price,
+            'items_count': items_count,
+        }
+
+    def update_totals(self):
+        """Recalculate the stored totals; call it inside the transaction that changed the cart."""
+        getattr(self, '_prefetched_objects_cache', {}).pop('products', None)
+        for field in self.TOTAL_FIELDS:
+            self.__dict__.pop(f'computed_{field}', None)
+        for field, value in self.calculate_totals().items():
+            setattr(self, field, value)
+        self.save(update_fields=self.TOTAL_FIELDS)
+
 
 class ShippingAddress(models.Model):
     product = models.ForeignKey(
@@ -240,6 +540,11 @@ class ShippingAddress(models.Model):
         auto_now_add=True,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_added'], name='shippingaddress_date_idx'),
+        ]
+
 
 class Contact(models.Model):
     name = models.CharField(
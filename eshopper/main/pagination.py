@@ -0,0 +1,219 @@
+import base64
+import binascii
+import json
+
+from django.core import signing
+from django.core.exceptions import BadRequest, FieldDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+PRODUCTS_PER_PAGE = 12
+# the sort values of one row fit many times over; longer cursors were not made here
+MAX_CURSOR_LENGTH = 512
+CURSOR_SALT = 'eshopper.main.pagination.cursor'
+# below this many rows an exact COUNT(*) is cheap enough and the planner estimate too rough
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def is_cursor_value(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        # what a BIGINT column can hold
+        return -2 ** 63 <= value < 2 ** 63
+    return value is None or isinstance(value, (float, str))
+
+
+def get_cursor_signer():
+    # signed, so the values a listing is asked to continue from are ones it handed out itself
+    return signing.Signer(salt=CURSOR_SALT, sep='.')
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_query = None
+        self.previous_query = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Cursor based paginator. Instead of an OFFSET it remembers the sort key of the last row of
+    a page and continues from there with an indexed range condition, so every page costs the
+    same and links stay stable while rows are inserted. The primary key is always appended to
+    the ordering as a tie-breaker. Nullable columns are sorted as their field default;
+    annotations may be used as well as long as they are never null.
+    """
+
+    def __init__(self, queryset, ordering, per_page=PRODUCTS_PER_PAGE):
+        self.per_page = per_page
+        self.keys = []
+        annotations = {}
+        model = queryset.model
+        for name in ordering:
+            descending = name.startswith('-')
+            field_name = name.lstrip('-')
+            try:
+                field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and field.null:
+                alias = f'keyset_{field_name}'
+                annotations[alias] = Coalesce(F(field_name), Value(field.get_default(), output_field=field))
+                field_name = alias
+            self.keys.append((field_name, descending))
+        self.keys.append(('pk', False))
+        self.queryset = queryset.annotate(**annotations)
+
+    def get_ordering(self, reverse=False):
+        return [
+            F(name).asc() if descending == reverse else F(name).desc()
+            for name, descending in self.keys
+        ]
+
+    def get_values(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def get_seek_q(self, values, reverse=False):
+        """Rows strictly after ``values`` in the ordering (or before them when reversed)."""
+        q = Q()
+        for position, (name, descending) in enumerate(self.keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[position]})
+            for previous_position, (previous_name, _) in enumerate(self.keys[:position]):
+                step &= Q(**{previous_name: values[previous_position]})
+            q |= step
+        return q
+
+    def encode_cursor(self, direction, obj):
+        payload = json.dumps([direction, self.get_values(obj)], separators=(',', ':'))
+        return get_cursor_signer().sign(base64.urlsafe_b64encode(payload.encode()).decode().rstrip('='))
+
+    def decode_cursor(self, cursor):
+        """The direction and sort values of a cursor this paginator issued; others are rejected."""
+        if len(cursor) > MAX_CURSOR_LENGTH:
+            raise InvalidCursor('That cursor is not valid')
+        try:
+            payload = get_cursor_signer().unsign(cursor)
+            padded = payload + '=' * (-len(payload) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (signing.BadSignature, binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+            raise InvalidCursor('That cursor is not valid')
+        if direction not in ('next', 'previous') or not isinstance(values, list) \
+                or len(values) != len(self.keys) or not all(map(is_cursor_value, values)):
+            raise InvalidCursor('That cursor is not valid')
+        return direction, values
+
+    def get_page(self, cursor=None):
+        if not cursor:
+            rows = list(self.queryset.order_by(*self.get_ordering())[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            return self._build_page(rows, has_next=has_more, has_previous=False)
+
+        direction, values = self.decode_cursor(cursor)
+        reverse = direction == 'previous'
+        try:
+            queryset = self.queryset.filter(self.get_seek_q(values, reverse=reverse))
+        except (TypeError, ValueError, ValidationError):
+            # values of the wrong type for their columns
+            raise InvalidCursor('That cursor is not valid')
+        rows = list(queryset.order_by(*self.get_ordering(reverse=reverse))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return self._build_page(rows, has_next=True, has_previous=has_more)
+        return self._build_page(rows, has_next=has_more, has_previous=True)
+
+    def _build_page(self, rows, has_next, has_previous):
+        next_cursor = self.encode_cursor('next', rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor('previous', rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+def get_valid_cursor(request, queryset, ordering):
+    """The ``cursor`` parameter of the request, checked against ``ordering``; '' without one."""
+    cursor = request.GET.get('cursor', '')
+    if cursor:
+        try:
+            KeysetPaginator(queryset, ordering).decode_cursor(cursor)
+        except InvalidCursor:
+            raise BadRequest('Invalid page')
+    return cursor
+
+
+def paginate(request, queryset, ordering, per_page=PRODUCTS_PER_PAGE, params=None):
+    """
+    Return the page of ``queryset`` selected by the ``cursor`` query parameter. The page links
+    keep the other parameters of the request, or only ``params`` when they are given.
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page=per_page)
+    try:
+        page = paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise BadRequest('Invalid page')
+
+    params = (request.GET if params is None else params).copy()
+    if page.has_next():
+        params['cursor'] = page.next_cursor
+        page.next_query = params.urlencode()
+    if page.has_previous():
+        params['cursor'] = page.previous_cursor
+        page.previous_query = params.urlencode()
+    return page
+
+
+def get_estimated_count(queryset):
+    """Row count of the queryset's table according to the planner statistics, -1 if unknown."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return -1
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    return int(row[0]) if row else -1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of big tables. When the list is not filtered it takes the
+    row count from pg_class instead of scanning the whole table; filtered lists and small
+    tables still get an exact count.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = get_estimated_count(self.object_list)
+            if estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
@@ -0,0 +1,145 @@
+"""
+A bounded, thread safe pool of database connections for one process. The database backend
+checks a connection out when Django connects at the start of a request and checks it back in
+when Django closes it at the end, so a request only pays for opening a connection when the
+pool has none to spare. Connections idle for longer than ``check_after`` seconds are pinged
+before they are handed out, and connections older than ``max_lifetime`` are replaced, so a
+restarted server or a dropped socket costs one reconnect instead of a failed request.
+"""
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 10
+DEFAULT_TIMEOUT = 5
+DEFAULT_CHECK_AFTER = 30
+DEFAULT_MAX_LIFETIME = 60 * 60
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    ``check(connection)`` tells whether an idle connection still works, ``reset(connection)``
+    prepares a returned one for reuse and tells whether it can be reused at all, and
+    ``close(connection)`` closes one for good.
+    """
+
+    def __init__(
+            self,
+            check,
+            reset,
+            close,
+            max_size=DEFAULT_MAX_SIZE,
+            timeout=DEFAULT_TIMEOUT,
+            check_after=DEFAULT_CHECK_AFTER,
+            max_lifetime=DEFAULT_MAX_LIFETIME,
+    ):
+        self.check = check
+        self.reset = reset
+        self.close = close
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_lifetime = max_lifetime
+
+        self._condition = threading.Condition()
+        # (connection, opened at, checked in at), the most recently used last
+        self._idle = []
+        self._opened_at = {}
+        self._size = 0
+        self.stats = {'created': 0, 'reused': 0, 'waits': 0, 'timeouts': 0, 'discarded': 0, 'failed_checks': 0}
+
+    def acquire(self, connect):
+        """Check out a connection, opening one with ``connect()`` when none is idle and there is room."""
+        while True:
+            entry = self._take()
+            if entry is None:
+                return self._open(connect)
+
+            connection, opened_at, checked_in_at = entry
+            now = time.monotonic()
+            if now - opened_at > self.max_lifetime:
+                self._discard(connection)
+                continue
+            if now - checked_in_at > self.check_after and not self.check(connection):
+                self._count('failed_checks')
+                self._discard(connection)
+                continue
+            self._count('reused')
+            return connection
+
+    def release(self, connection):
+        """Check a connection back in, or close it when it is broken or too old."""
+        opened_at = self._opened_at.get(id(connection))
+        if (
+            opened_at is None
+            or time.monotonic() - opened_at > self.max_lifetime
+            or not self.reset(connection)
+        ):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, opened_at, time.monotonic()))
+            self._condition.notify()
+
+    def close_idle(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        stats['in_use'] = stats['size'] - stats['idle']
+        return stats
+
+    def _take(self):
+        """An idle entry, or ``None`` after reserving room for a new connection."""
+        deadline = None
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                if deadline is None:
+                    self.stats['waits'] += 1
+                    deadline = time.monotonic() + self.timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(f'No connection became free within {self.timeout} seconds')
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+            return None
+
+    def _open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opened_at[id(connection)] = time.monotonic()
+            self.stats['created'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            self.close(connection)
+        except Exception:
+            pass
+        with self._condition:
+            if self._opened_at.pop(id(connection), None) is not None:
+                self._size -= 1
+            self.stats['discarded'] += 1
+            self._condition.notify()
+
+    def _count(self, counter):
+        with self._condition:
+            self.stats[counter] += 1
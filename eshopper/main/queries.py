@@ -0,0 +1,71 @@
+"""
+Query instrumentation. ``QueryRecorder`` is installed as an execute wrapper on every database
+connection and collects the count, the time and the fingerprints of the statements a block of
+code runs; the middleware reports them per request and the tests hold URLs to query budgets.
+"""
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+FINGERPRINT_SUBSTITUTIONS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    # IN lists of any length are the same statement
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(sql):
+    """The statement with its literals and placeholders blanked out, to group repeated queries."""
+    for pattern, replacement in FINGERPRINT_SUBSTITUTIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.fingerprint_durations = defaultdict(float)
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            key = fingerprint(sql)
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[key] += 1
+            self.fingerprint_durations[key] += duration
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """Statements run more than once with the same parameters."""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def get_repeated_fingerprints(self):
+        """Fingerprints run more than once, the usual shape of an N+1, most frequent first."""
+        return [(key, count) for key, count in self.fingerprints.most_common() if count > 1]
+
+    def get_slowest_fingerprints(self, limit=5):
+        ranked = sorted(self.fingerprint_durations.items(), key=lambda item: item[1], reverse=True)
+        return [(key, self.fingerprints[key], duration) for key, duration in ranked[:limit]]
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, IntegerField, Value, When
+
+from eshopper.main.models import Product
+
+RELATED_PRODUCTS_LIMIT = 8
+
+
+def get_bucket_key(category, size):
+    return f'related_products:{category}:{size}'
+
+
+def build_bucket(category, size):
+    """
+    Rank the products of a category for the (category, size) bucket: products of the same size
+    come first, then the rest of the category in listing order. One more product than shown is
+    kept so the product itself can be left out of its own list.
+    """
+    same_size_first = Case(
+        When(sizes=size, then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+    product_ids = list(
+        Product.objects
+            .using(DEFAULT_DB_ALIAS)
+            .filter(categories=category)
+            .annotate(size_rank=same_size_first)
+            .order_by('size_rank', 'effective_price', 'pk')
+            .values_list('pk', flat=True)[:RELATED_PRODUCTS_LIMIT + 1]
+    )
+    cache.set(get_bucket_key(category, size), product_ids, settings.RELATED_PRODUCTS_TIMEOUT)
+    return product_ids
+
+
+def refresh_category(category):
+    """Rebuild the buckets of one category; the rest of the index is untouched."""
+    for size, _ in Product.SIZES:
+        build_bucket(category, size)
+
+
+def get_related_products(product):
+    product_ids = cache.get(get_bucket_key(product.categories, product.sizes))
+    if product_ids is None:
+        product_ids = build_bucket(product.categories, product.sizes)
+    product_ids = [pk for pk in product_ids if pk != product.pk][:RELATED_PRODUCTS_LIMIT]
+
+    products = Product.objects.in_bulk(product_ids)
+    return [products[pk] for pk in product_ids if pk in products]
@@ -0,0 +1,91 @@
+"""
+Primary and replica routing. Writes and everything that has to be current, the cart, checkout,
+auth and sessions, use ``default``; catalog reads of safe requests go to one of the aliases in
+``DATABASE_REPLICAS``, picked once per request. A request that writes reads from the primary
+from then on, and its client stays pinned to the primary for ``PRIMARY_STICKY_SECONDS`` so
+that the next pages never show data older than its own write. Code running outside of a
+request, such as management commands and signal handlers of background jobs, always uses the
+primary. So does everything read to fill a shared cache: a replica that has not caught up with
+an invalidation would otherwise put the old data back for as long as the entry lives.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_PIN_COOKIE = 'primary_pin'
+# models whose reads may lag behind the primary by the replication delay
+REPLICA_READ_MODELS = frozenset(('main.product',))
+
+
+class RoutingState:
+    def __init__(self, read_database):
+        self.read_database = read_database
+        self.wrote = False
+
+
+_routing_state = ContextVar('routing_state', default=None)
+
+
+@contextmanager
+def route_reads(read_database):
+    """Send the replica reads of the block to ``read_database``, ``None`` keeps them on the primary."""
+    state = RoutingState(read_database)
+    token = _routing_state.set(state)
+    try:
+        yield state
+    finally:
+        _routing_state.reset(token)
+
+
+def read_from_primary():
+    """Send the remaining reads of the current request to the primary."""
+    state = _routing_state.get()
+    if state is not None:
+        state.read_database = None
+
+
+def get_read_database():
+    state = _routing_state.get()
+    if state is None or state.read_database is None:
+        return DEFAULT_DB_ALIAS
+    return state.read_database
+
+
+def pick_read_database(request):
+    """The replica serving ``request``, or ``None`` when it has to read from the primary."""
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas or request.method not in ('GET', 'HEAD') or request.COOKIES.get(PRIMARY_PIN_COOKIE):
+        return None
+    return random.choice(replicas)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if 'instance' in hints:
+            # related objects are read from the database their instance came from
+            return None
+        if model._meta.label_lower not in REPLICA_READ_MODELS:
+            return DEFAULT_DB_ALIAS
+        return get_read_database()
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+            state.read_database = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas follow the primary, migrations run there only
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,126 @@
+from django.db.models import Count, Q
+
+from eshopper.main.fulltext import annotate_relevance, filter_matching
+from eshopper.main.models import Product
+
+PRICE_RANGES = (
+    (0, 100),
+    (100, 200),
+    (200, 300),
+    (300, 400),
+    (400, 500),
+)
+
+
+def is_valid_queryparam(param):
+    return param != '' and param is not None
+
+
+class Facet:
+    """A multi-select filter dimension: the selected options of one facet are OR-ed together."""
+
+    def __init__(self, param, title, options):
+        self.param = param
+        self.title = title
+        # (value, label, Q) triples
+        self.options = options
+
+    def get_q(self, selected):
+        q = Q()
+        for value, _, option_q in self.options:
+            if value in selected:
+                q |= option_q
+        return q
+
+
+FACETS = (
+    Facet('category', 'Filter by category', [
+        (value, label, Q(categories=value)) for value, label in Product.CATEGORIES
+    ]),
+    Facet('size', 'Filter by size', [
+        (value, label, Q(sizes=value)) for value, label in Product.SIZES
+    ]),
+    Facet('price', 'Filter by price', [
+        (f'{low}-{high}', f'${low} - ${high}', Q(effective_price__gte=low, effective_price__lt=high)) for low, high in PRICE_RANGES
+    ]),
+)
+
+
+PRODUCT_ORDERING = ('effective_price',)
+
+
+class ProductSearch:
+    """
+    Filters the catalog by the facets selected in the query string and counts the products
+    matching every facet option. The count of an option applies the selections of all other
+    facets but not of its own, so choosing more options of a facet never hides them.
+    """
+
+    def __init__(self, params, queryset=None):
+        if queryset is None:
+            queryset = Product.objects.all()
+        self.queryset = queryset
+        self.name_contains = params.get('name_contains')
+        self.selected = {
+            facet.param: [value for value in params.getlist(facet.param) if is_valid_queryparam(value)]
+            for facet in FACETS
+        }
+
+    def is_text_search(self):
+        return is_valid_queryparam(self.name_contains)
+
+    def get_base_queryset(self):
+        qs = self.queryset
+        if self.is_text_search():
+            qs = filter_matching(qs, self.name_contains)
+        return qs
+
+    def get_facet_q(self, exclude=None):
+        q = Q()
+        for facet in FACETS:
+            if facet.param != exclude:
+                q &= facet.get_q(self.selected[facet.param])
+        return q
+
+    def get_ordering(self):
+        """Text searches are ranked by relevance, the listing order only breaks ties."""
+        if self.is_text_search():
+            return ('-relevance',) + PRODUCT_ORDERING
+        return PRODUCT_ORDERING
+
+    def get_queryset(self):
+        qs = self.get_base_queryset().filter(self.get_facet_q())
+        if self.is_text_search():
+            qs = annotate_relevance(qs, self.name_contains)
+        return qs.order_by(*self.get_ordering())
+
+    def get_facet_counts(self):
+        """Count the products of every facet option with a single aggregate query."""
+        aggregates = {}
+        for facet in FACETS:
+            other_q = self.get_facet_q(exclude=facet.param)
+            aggregates[f'{facet.param}__all'] = Count('pk', filter=other_q)
+            for value, _, option_q in facet.options:
+                aggregates[f'{facet.param}__{value}'] = Count('pk', filter=other_q & option_q)
+        return self.get_base_queryset().order_by().aggregate(**aggregates)
+
+    def get_facets(self):
+        counts = self.get_facet_counts()
+        return [
+            {
+                'param': facet.param,
+                'title': facet.title,
+                'count': counts[f'{facet.param}__all'],
+                'any_selected': bool(self.selected[facet.param]),
+                'options': [
+                    {
+                        'value': value,
+                        'label': label,
+                        'count': counts[f'{facet.param}__{value}'],
+                        'selected': value in self.selected[facet.param],
+                    }
+                    for value, label, _ in facet.options
+                ],
+            }
+            for facet in FACETS
+        ]
@@ -0,0 +1,132 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from eshopper.main.caching import (
+    SEARCH_SURROGATE_KEY,
+    category_surrogate_key,
+    invalidate_category,
+    invalidate_product,
+    product_surrogate_key,
+    purge_surrogate_keys,
+)
+from eshopper.main.cart import remove_from_all_carts
+from eshopper.main.conditional import record_listing_removal
+from eshopper.main.fulltext import index_product, unindex_product
+from eshopper.main.images import delete_variants, generate_variants
+from eshopper.main.models import Product
+from eshopper.main.related import refresh_category
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    loaded_values = getattr(instance, '_loaded_values', {})
+    categories = {instance.categories, loaded_values.get('categories')} - {None}
+    slugs = {instance.slug, loaded_values.get('slug')} - {None}
+    old_image = loaded_values.get('image')
+    image_changed = kwargs['signal'] is post_save and instance.image.name != old_image
+    listing_changed = kwargs.get('created', True) or any(
+        loaded_values.get(field) != getattr(instance, field) for field in Product.LISTING_FIELDS
+    )
+    instance._loaded_values = {
+        'categories': instance.categories,
+        'image': instance.image.name,
+        'slug': instance.slug,
+        'sizes': instance.sizes,
+        'effective_price': instance.effective_price,
+    }
+
+    for category in categories:
+        invalidate_category(category)
+
+    if kwargs['signal'] is post_delete:
+        unindex_product(instance.pk, using=kwargs['using'])
+    else:
+        index_product(instance, using=kwargs['using'])
+    if kwargs['signal'] is post_delete or len(categories) > 1:
+        # MAX(updated_at) of a listing cannot tell that a product left it
+        transaction.on_commit(lambda: record_listing_removal(categories))
+
+    # pages showing the product; listings of its categories only when it moved in or out of
+    # them or changed place
+    surrogate_keys = [product_surrogate_key(instance.pk), SEARCH_SURROGATE_KEY]
+    if listing_changed:
+        surrogate_keys += [category_surrogate_key(category) for category in categories]
+
+    def invalidate_products():
+        # after the commit, so a lookup in between cannot cache the old row under the new version
+        invalidate_product(*slugs)
+        purge_surrogate_keys(*surrogate_keys)
+
+    transaction.on_commit(invalidate_products)
+
+    def refresh_related_products():
+        for category in categories:
+            refresh_category(category)
+
+    transaction.on_commit(refresh_related_products)
+
+    if image_changed:
+        transaction.on_commit(lambda: update_image_variants(instance))
+    if kwargs['signal'] is post_delete:
+        replaced_image = instance.image.name
+    else:
+        replaced_image = old_image if image_changed else None
+    if replaced_image:
+        transaction.on_commit(lambda: delete_unused_variants(replaced_image))
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # before the lines lose their product to SET_NULL and can no longer be found
+    remove_from_all_carts(instance)
+
+
+def invalidate_written_products(rows, listing_changed, using):
+    """The part of ``product_changed`` that applies to bulk writes, which send no signals."""
+    pks = {pk for pk, _, _ in rows} - {None}
+    slugs = {slug for _, slug, _ in rows} - {None}
+    categories = {category for _, _, category in rows} - {None}
+
+    for category in categories:
+        invalidate_category(category)
+
+    surrogate_keys = [*(product_surrogate_key(pk) for pk in pks), SEARCH_SURROGATE_KEY]
+    if listing_changed:
+        surrogate_keys += [category_surrogate_key(category) for category in categories]
+
+    def invalidate_products():
+        invalidate_product(*slugs)
+        purge_surrogate_keys(*surrogate_keys)
+        if listing_changed:
+            for category in categories:
+                refresh_category(category)
+
+    transaction.on_commit(invalidate_products, using=using)
+
+
+def delete_unused_variants(name):
+    # generated catalogs share images between products
+    if Product.objects.filter(image=name).exists():
+        return
+    try:
+        delete_variants(name)
+    except Exception:
+        logger.exception('Could not delete the variants of %s', name)
+
+
+def update_image_variants(product):
+    # the product is already saved, a missing or unreadable upload must not fail the request
+    try:
+        widths = generate_variants(product.image.name) if product.image else []
+    except Exception:
+        logger.exception('Could not generate the variants of %s', product.image.name)
+        widths = []
+    # the update invalidates the cached product
+    Product.objects.filter(pk=product.pk).update(image_variants=widths)
+    product.image_variants = widths
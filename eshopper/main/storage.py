@@ -0,0 +1,67 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip siblings are always written
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.map', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.eot', '.otf')
+
+# a compressed sibling is only kept when it saves at least this much
+MIN_COMPRESSION_RATIO = 0.95
+
+
+def compress_gzip(content):
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def compress_brotli(content):
+    return brotli.compress(content, quality=11)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Writes content-hashed copies of the static files with a manifest, plus ``.gz`` and ``.br``
+    siblings of text assets that ``StaticFilesMiddleware`` serves to clients accepting them.
+    Files missing from the manifest (e.g. referenced by a template but absent on disk) are
+    linked unhashed instead of failing the page.
+    """
+    manifest_strict = False
+
+    def get_encoders(self):
+        encoders = [('gz', compress_gzip)]
+        if brotli is not None:
+            encoders.append(('br', compress_brotli))
+        return encoders
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        # only the final names: intermediate hashed copies of adjusted css are gone by now
+        stored_names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(stored_names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        for suffix, compress in self.get_encoders():
+            compressed = compress(content)
+            if len(compressed) > len(content) * MIN_COMPRESSION_RATIO:
+                continue
+            compressed_name = f'{name}.{suffix}'
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
@@ -1,14 +1,11 @@
 from django import template
 
-from eshopper.main.models import Order
-
 register = template.Library()
 
 
 @register.filter
-def cart_item_count(user):
-    if user.is_authenticated:
-        queryset = Order.objects.filter(user=user, ordered=False)
-        if queryset.exists():
-            return queryset[0].products.count()
+def cart_item_count(request):
+    order = getattr(request, 'cart', None)
+    if order:
+        return order.items_count
     return 0
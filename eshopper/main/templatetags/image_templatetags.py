@@ -0,0 +1,36 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from eshopper.main.images import get_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, sizes, css_class='', alt='', style=''):
+    """
+    Render the image of a product with WebP and resized ``srcset`` candidates, letting the
+    browser pick the smallest file for the ``sizes`` it is laid out at.
+    """
+    image = product.image
+    if not image:
+        # the same placeholder the product grid shows
+        return format_html('<img class="{}" style="{}" src="{}" alt="{}">', css_class, style, static('img/login.png'), alt)
+    if not product.image_variants:
+        return format_html('<img class="{}" style="{}" src="{}" alt="{}">', css_class, style, image.url, alt)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img class="{}" style="{}" src="{}" srcset="{}" sizes="{}" alt="{}">'
+        '</picture>',
+        get_srcset(image.name, product.image_variants, 'webp'),
+        sizes,
+        css_class,
+        style,
+        image.url,
+        get_srcset(image.name, product.image_variants),
+        sizes,
+        alt,
+    )
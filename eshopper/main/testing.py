@@ -0,0 +1,20 @@
+from django.urls import reverse
+
+from eshopper.main.queries import record_queries
+from eshopper.main.urls import QUERY_BUDGETS
+
+
+class QueryBudgetMixin:
+    """Test case mixin requesting pages by URL name and failing when they exceed their query budget."""
+
+    def assertWithinQueryBudget(self, url_name, args=(), method='get', **kwargs):
+        budget = QUERY_BUDGETS[url_name]
+        with record_queries() as recorder:
+            response = getattr(self.client, method)(reverse(url_name, args=args), **kwargs)
+        if recorder.count > budget:
+            repeated = '\n'.join(f'  {count}x {key}' for key, count in recorder.get_repeated_fingerprints())
+            self.fail(
+                f'{url_name} ran {recorder.count} queries, its budget is {budget}'
+                + (f'; repeated statements:\n{repeated}' if repeated else '')
+            )
+        return response
@@ -1,3 +1,1340 @@
-from django.test import TestCase
+import base64
+import gzip
+import importlib
+import io
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_INERROR,
+    TRANSACTION_STATUS_INTRANS,
+    TRANSACTION_STATUS_UNKNOWN,
+)
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+
+from eshopper.main import caching, cart, ids, images, loadtest, related, routers, storage
+from eshopper.main.admin import OrderAdmin
+from eshopper.main.backends.postgresql_pool import base as postgresql_pool
+from eshopper.main.checkout import CheckoutError, place_order
+from eshopper.main.middleware import StaticFilesMiddleware
+from eshopper.main.models import Customer, Order, OrderItem, Product, ShippingAddress
+from eshopper.main.pagination import (
+    EstimatedCountPaginator,
+    KeysetPaginator,
+    get_cursor_signer,
+    get_estimated_count,
+)
+from eshopper.main.pool import ConnectionPool, PoolTimeout
+from eshopper.main.search import ProductSearch
+from eshopper.main.storage import CompressedManifestStaticFilesStorage
+from eshopper.main.testing import QueryBudgetMixin
+from eshopper.main.urls import QUERY_BUDGETS, urlpatterns
+from eshopper.main.views import CATEGORY_ORDERING
+
+
+def create_product(slug, price=10, price_with_discount=0, **kwargs):
+    return Product.objects.create(
+        name=slug,
+        categories=kwargs.pop('categories', 'shirts'),
+        sizes=kwargs.pop('sizes', 'M'),
+        price=price,
+        price_with_discount=price_with_discount,
+        description=kwargs.pop('description', slug),
+        slug=slug,
+        **kwargs,
+    )
+
+
+def count_statements(queries):
+    """Queries sent by the code under test, without the transaction control of the backend."""
+    return len([query for query in queries if not query['sql'].startswith(('BEGIN', 'SAVEPOINT', 'RELEASE'))])
+
+
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        self.product = create_product('shirt', price=20, price_with_discount=15)
+
+    def assertEffectivePrice(self, expected):
+        self.assertEqual(expected, Product.objects.values_list('effective_price', flat=True).get(pk=self.product.pk))
+
+    def test_saving_sets_the_effective_price(self):
+        self.assertEffectivePrice(15)
+        self.product.price_with_discount = 0
+        self.product.save(update_fields=['price_with_discount'])
+        self.assertEffectivePrice(20)
+
+    def test_bulk_writes_keep_the_effective_price(self):
+        Product.objects.filter(pk=self.product.pk).update(price=30, price_with_discount=None)
+        self.assertEffectivePrice(30)
+        Product.objects.filter(pk=self.product.pk).update(price_with_discount=F('price') - 5)
+        self.assertEffectivePrice(25)
+
+        self.product.refresh_from_db()
+        self.product.price_with_discount = 12
+        Product.objects.bulk_update([self.product], ['price_with_discount'])
+        self.assertEffectivePrice(12)
+
+    def test_listings_use_the_effective_price(self):
+        create_product('jeans', price=18)
+        search = ProductSearch(QueryDict('price=0-50'))
+
+        self.assertEqual(['shirt', 'jeans'], [product.slug for product in search.get_queryset()])
+
+
+class ProductCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.local_products.clear()
+        self.product = create_product('shirt')
+
+    def get_lookups(self):
+        stats = caching.get_product_cache_stats()
+        return stats['local_hits'], stats['shared_hits'], stats['misses']
+
+    def assertLookups(self, local_hits, shared_hits, misses, before):
+        after = self.get_lookups()
+        self.assertEqual((local_hits, shared_hits, misses), tuple(a - b for a, b in zip(after, before)))
+
+    def test_lookups_are_served_from_memory_then_the_shared_cache(self):
+        before = self.get_lookups()
+        with self.assertNumQueries(1):
+            caching.get_product('shirt')
+            caching.get_product('shirt')
+        caching.local_products.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.product.pk, caching.get_product('shirt').pk)
+
+        self.assertLookups(1, 1, 1, before)
+
+    def test_a_change_causes_exactly_one_miss(self):
+        caching.get_product('shirt')
+        before = self.get_lookups()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 25
+            self.product.save()
+
+        self.assertEqual(25, caching.get_product('shirt').price)
+        caching.get_product('shirt')
+        self.assertLookups(1, 0, 1, before)
+
+    def test_renaming_the_slug_invalidates_the_old_one(self):
+        caching.get_product('shirt')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.slug = 'blouse'
+            self.product.save()
+
+        self.assertIsNone(caching.get_product('shirt'))
+        self.assertEqual(self.product.pk, caching.get_product('blouse').pk)
+
+    def test_bulk_writes_invalidate_the_cached_product(self):
+        caching.get_product('shirt')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(price=99)
+        self.assertEqual(99, caching.get_product('shirt').effective_price)
+
+        self.product.refresh_from_db()
+        self.product.slug = 'blouse'
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_update([self.product], ['slug'])
+        self.assertIsNone(caching.get_product('shirt'))
+
+    def test_bulk_writes_purge_the_pages_of_the_product(self):
+        versions = caching.get_surrogate_versions([caching.product_surrogate_key(self.product.pk), 'category:jeans'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(categories='jeans')
+
+        self.assertFalse(set(versions.items()) & set(caching.get_surrogate_versions(versions).items()))
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = create_product('shirt', price=30)
+        self.polo = create_product('polo', price=20, sizes='L')
+        self.tee = create_product('tee', price=25)
+        self.jeans = create_product('jeans', categories='jeans')
+
+    def get_related(self, product):
+        return [related_product.slug for related_product in related.get_related_products(product)]
+
+    def test_the_same_size_comes_first_and_the_product_is_left_out(self):
+        self.assertEqual(['tee', 'polo'], self.get_related(self.shirt))
+        self.assertEqual(['tee', 'shirt'], self.get_related(self.polo))
+
+    def test_lists_are_bounded(self):
+        for index in range(related.RELATED_PRODUCTS_LIMIT + 2):
+            create_product(f'shirt-{index}', price=40)
+
+        self.assertEqual(related.RELATED_PRODUCTS_LIMIT, len(self.get_related(self.shirt)))
+
+    def test_saving_a_product_rebuilds_its_category(self):
+        self.get_related(self.shirt)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tee.categories = 'jeans'
+            self.tee.save()
+
+        self.assertEqual(['polo'], self.get_related(self.shirt))
+        self.assertEqual(['tee'], self.get_related(self.jeans))
+
+    def test_bulk_writes_rebuild_the_categories(self):
+        self.get_related(self.shirt)
+        self.tee.sizes = 'L'
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.bulk_update([self.tee], ['sizes'])
+        self.assertEqual(['polo', 'tee'], self.get_related(self.shirt))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.tee.pk).update(categories='jeans')
+        self.assertEqual(['polo'], self.get_related(self.shirt))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        create_product('shirt-s', categories='shirts', sizes='S', price=50)
+        create_product('shirt-m', categories='shirts', sizes='M', price=150)
+        create_product('jeans-m', categories='jeans', sizes='M', price=60)
+        create_product('jacket-l', categories='jackets', sizes='L', price=250)
+
+    def get_counts(self, query):
+        return {
+            facet['param']: {option['value']: option['count'] for option in facet['options'] if option['count']}
+            for facet in ProductSearch(QueryDict(query)).get_facets()
+        }
+
+    def get_slugs(self, query):
+        return sorted(ProductSearch(QueryDict(query)).get_queryset().values_list('slug', flat=True))
+
+    def test_counts_ignore_the_selection_of_their_own_facet(self):
+        counts = self.get_counts('category=shirts&size=M')
+
+        # every category among the M products, every size among the shirts
+        self.assertEqual({'shirts': 1, 'jeans': 1}, counts['category'])
+        self.assertEqual({'S': 1, 'M': 1}, counts['size'])
+        self.assertEqual({'100-200': 1}, counts['price'])
+
+    def test_options_of_one_facet_are_combined(self):
+        self.assertEqual(['jeans-m', 'shirt-m', 'shirt-s'], self.get_slugs('category=shirts&category=jeans'))
+        self.assertEqual(['jeans-m', 'shirt-s'], self.get_slugs('category=shirts&category=jeans&price=0-100'))
+        self.assertEqual({'0-100': 2, '100-200': 1}, self.get_counts('category=shirts&category=jeans')['price'])
+
+    def test_all_counts_take_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            ProductSearch(QueryDict('category=shirts&size=M&size=S&price=0-100')).get_facets()
+
+        self.assertEqual(1, count_statements(queries))
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.linen = create_product('linen-shirt', description='A light summer shirt')
+        self.cotton = create_product('cotton-shirt', description='Cotton, softer than linen')
+        create_product('jeans', description='Straight denim')
+
+    def search(self, term):
+        return list(ProductSearch(QueryDict(f'name_contains={term}')).get_queryset().values_list('slug', flat=True))
+
+    def test_names_rank_above_descriptions(self):
+        self.assertEqual(['linen-shirt', 'cotton-shirt'], self.search('linen'))
+        self.assertEqual(['linen-shirt', 'cotton-shirt'], self.search('shirt'))
+        self.assertEqual([], self.search('wool'))
+
+    def test_bulk_writes_keep_the_index(self):
+        Product.objects.filter(pk=self.cotton.pk).update(name='Wool jumper')
+        self.assertEqual(['cotton-shirt'], self.search('wool'))
+
+        self.linen.description = 'Heavy wool'
+        Product.objects.bulk_update([self.linen], ['description'])
+        self.assertEqual(['cotton-shirt', 'linen-shirt'], self.search('wool'))
+        self.assertEqual([], self.search('summer'))
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        # three prices shared by several products, so pages break inside runs of ties
+        self.products = [create_product(f'shirt-{index}', price=index % 3 + 1) for index in range(8)]
+
+    def walk(self, paginator):
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return pages
+
+    def test_cursors_round_trip(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('effective_price',))
+        product = self.products[4]
+
+        direction, values = paginator.decode_cursor(paginator.encode_cursor('next', product))
+        self.assertEqual(('next', [product.effective_price, product.pk]), (direction, values))
+
+    def test_pages_cover_every_row_once_despite_ties(self):
+        for ordering in [('effective_price',), ('-effective_price',)]:
+            pages = self.walk(KeysetPaginator(Product.objects.all(), ordering, per_page=3))
+            seen = [(product.effective_price, product.pk) for page in pages for product in page]
+
+            expected = sorted(
+                ((product.effective_price, product.pk) for product in self.products),
+                key=lambda key: (-key[0] if ordering[0].startswith('-') else key[0], key[1]),
+            )
+            self.assertEqual(expected, seen)
+            self.assertEqual([3, 3, 2], [len(page) for page in pages])
+
+    def test_previous_and_next_at_both_ends(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('effective_price',), per_page=3)
+        first, second, last = self.walk(paginator)
+
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+        self.assertTrue(last.has_previous())
+        self.assertFalse(last.has_next())
+        self.assertEqual(list(second), list(paginator.get_page(last.previous_cursor)))
+        back_to_first = paginator.get_page(second.previous_cursor)
+        self.assertEqual(list(first), list(back_to_first))
+        self.assertFalse(back_to_first.has_previous())
+
+    def test_invalid_cursors_are_bad_requests(self):
+        def encode(payload):
+            return get_cursor_signer().sign(base64.urlsafe_b64encode(json.dumps(payload).encode()).decode())
+
+        forged = base64.urlsafe_b64encode(json.dumps(['next', [1.0, 1]]).encode()).decode()
+        cursors = [
+            'garbage',
+            forged,
+            f'{forged}.{get_cursor_signer().sign(forged).rsplit(".", 1)[1][::-1]}',
+            encode(['next', ['cheap', 'x']]),
+            encode(['next', [1, 2 ** 70]]),
+            'x' * 600,
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor[:20]):
+                self.assertEqual(400, self.client.get(reverse('shop'), {'cursor': cursor}).status_code)
+
+
+class CategoryGridCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for index in range(14):
+            create_product(f'shirt-{index}', price=index + 1)
+        self.client.force_login(User.objects.create_user('buyer'))
+        self.url = reverse('shop_category', args=['shirts'])
+
+    def test_only_valid_cursors_are_cached_under_a_short_key(self):
+        cursor = KeysetPaginator(Product.objects.filter(categories='shirts'), CATEGORY_ORDERING).get_page().next_cursor
+        self.assertEqual(200, self.client.get(self.url, {'cursor': cursor}).status_code)
+        self.assertIsNotNone(caching.get_cached_category_grid('shirts', cursor))
+        self.assertLess(len(caching.get_category_grid_key('shirts', 'x' * 1000)), 100)
+
+        response = self.client.get(self.url, {'cursor': 'x' * 1000})
+        self.assertEqual(400, response.status_code)
+        self.assertIsNone(caching.get_cached_category_grid('shirts', 'x' * 1000))
+
+    def test_forged_cursors_are_not_cached(self):
+        forged = base64.urlsafe_b64encode(json.dumps(['next', [3.5, 1]]).encode()).decode()
+
+        self.assertEqual(400, self.client.get(self.url, {'cursor': forged}).status_code)
+        self.assertIsNone(caching.get_cached_category_grid('shirts', forged))
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.local_products.clear()
+        self.shirt = create_product('shirt', categories='shirts')
+        self.jeans = create_product('jeans', categories='jeans')
+
+    def get_page_cache(self, url):
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return response.get('X-Page-Cache')
+
+    def test_anonymous_pages_are_cached(self):
+        url = reverse('product_details', args=['shirt'])
+
+        self.assertEqual('miss', self.get_page_cache(url))
+        with self.assertNumQueries(0):
+            self.assertEqual('hit', self.get_page_cache(url))
+
+    def test_signed_in_users_get_live_pages(self):
+        self.client.force_login(User.objects.create_user('buyer'))
+        url = reverse('shop')
+
+        self.assertIsNone(self.get_page_cache(url))
+        self.assertIsNone(self.get_page_cache(url))
+
+    def test_saving_a_product_purges_the_pages_showing_it(self):
+        urls = [
+            reverse('product_details', args=['shirt']),
+            reverse('product_details', args=['jeans']),
+            reverse('shop_category', args=['shirts']),
+            reverse('shop_category', args=['jeans']),
+            reverse('shop'),
+        ]
+        for url in urls:
+            self.get_page_cache(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.name = 'Linen shirt'
+            self.shirt.save()
+
+        self.assertEqual(
+            ['miss', 'hit', 'miss', 'hit', 'miss'],
+            [self.get_page_cache(url) for url in urls],
+        )
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.local_products.clear()
+        self.shirt = create_product('shirt', categories='shirts')
+        self.blouse = create_product('blouse', categories='shirts')
+        self.client.force_login(User.objects.create_user('buyer'))
+        self.url = reverse('shop_category', args=['shirts'])
+
+    def test_unchanged_pages_are_not_rendered_again(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertTemplateNotUsed('shop_category.html'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_changes_and_deletions_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.name = 'Linen shirt'
+            self.shirt.save()
+        changed_etag = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blouse.delete()
+
+        self.assertNotEqual(etag, changed_etag)
+        self.assertEqual(200, self.client.get(self.url, HTTP_IF_NONE_MATCH=changed_etag).status_code)
+
+    def test_moving_a_product_out_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.blouse.pk).update(categories='dresses')
+        moved_etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirt.categories = 'jeans'
+            self.shirt.save()
+
+        self.assertNotEqual(etag, moved_etag)
+        self.assertNotEqual(moved_etag, self.client.get(self.url)['ETag'])
+
+    def test_validators_do_not_count_the_products(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"')
+
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+    def test_the_cart_is_part_of_the_etag(self):
+        url = reverse('product_details', args=['shirt'])
+        etag = self.client.get(url)['ETag']
+        self.client.get(reverse('add_to_cart', args=['blouse']))
+
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_anonymous_visitors_revalidate_by_date(self):
+        self.client.logout()
+        last_modified = self.client.get(reverse('shop'))['Last-Modified']
+
+        response = self.client.get(reverse('shop'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, response.status_code)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.local_products.clear()
+        self.shirt = create_product('shirt', categories='shirts', price=20, price_with_discount=15)
+        self.blouse = create_product('blouse', categories='shirts')
+        self.jeans = create_product('jeans', categories='jeans')
+        self.user = User.objects.create_user('buyer')
+        cart.add_item(self.user, self.shirt)
+        cart.add_item(self.user, self.jeans)
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urlpatterns}
+
+        self.assertEqual(names, set(QUERY_BUDGETS))
+
+    def test_catalog_pages_stay_within_budget(self):
+        for user in (None, self.user):
+            if user:
+                self.client.force_login(user)
+            self.assertWithinQueryBudget('index')
+            self.assertWithinQueryBudget('shop')
+            self.assertWithinQueryBudget('shop', data={'price': '0-100', 'size': 'M'})
+            self.assertWithinQueryBudget('shop_category', args=['shirts'])
+            self.assertWithinQueryBudget('product_details', args=['shirt'])
+            self.assertWithinQueryBudget('contact')
+
+    def test_cart_pages_stay_within_budget(self):
+        self.client.force_login(self.user)
+
+        self.assertWithinQueryBudget('cart')
+        self.assertWithinQueryBudget('checkout')
+        self.assertWithinQueryBudget('add_to_cart', args=['blouse'])
+        self.assertWithinQueryBudget('add_to_cart', args=['blouse'])
+        self.assertWithinQueryBudget('decrease_quantity_of_item_from_cart', args=['blouse'])
+        self.assertWithinQueryBudget('remove_from_cart', args=['jeans'])
+        self.assertWithinQueryBudget(
+            'cart_api',
+            method='post',
+            data={'operations': [{'slug': 'jeans', 'delta': 2}, {'slug': 'shirt', 'remove': True}]},
+            content_type='application/json',
+        )
+
+
+class GenerateDatasetTests(TestCase):
+    def generate(self):
+        call_command('generate_dataset', products=20, users=5, seed=1, stdout=io.StringIO())
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('pk').values_list('slug', 'name', 'categories', 'sizes', 'effective_price')),
+            list(Order.objects.order_by('pk').values_list('transaction_id', 'user__username', 'ordered', 'total')),
+            list(OrderItem.objects.order_by('pk').values_list('product__slug', 'quantity', 'unit_price')),
+        )
+
+    def test_rows_and_stored_totals(self):
+        self.generate()
+
+        self.assertEqual(20, Product.objects.count())
+        self.assertEqual(5, User.objects.count())
+        self.assertEqual(5, Customer.objects.count())
+        self.assertEqual(Order.objects.filter(ordered=True).count(), ShippingAddress.objects.count())
+        self.assertEqual(OrderItem.objects.count(), Order.products.through.objects.count())
+        for order in Order.objects.with_totals():
+            with self.subTest(order=order.transaction_id):
+                self.assertAlmostEqual(order.computed_sub_total, order.sub_total)
+                self.assertAlmostEqual(order.computed_total, order.total)
+                self.assertEqual(order.computed_items_count, order.items_count)
+
+    def test_the_same_seed_gives_the_same_data(self):
+        self.generate()
+        first = self.snapshot()
+
+        ShippingAddress.objects.all().delete()
+        User.objects.all().delete()
+        Product.objects.all().delete()
+        OrderItem.objects.all().delete()
+        self.generate()
+
+        self.assertEqual(first, self.snapshot())
+
+    def test_sequences_continue_after_the_generated_rows(self):
+        self.generate()
+
+        product = create_product('after-the-dataset')
+        user = User.objects.create_user('after-the-dataset')
+        self.assertGreater(product.pk, 20)
+        self.assertGreater(user.pk, 5)
+
+
+class LoadTestReportTests(SimpleTestCase):
+    def test_percentiles_use_the_nearest_rank(self):
+        durations = list(range(1, 101))
+
+        self.assertEqual(50, loadtest.percentile(durations, 0.50))
+        self.assertEqual(95, loadtest.percentile(durations, 0.95))
+        self.assertEqual(99, loadtest.percentile(durations, 0.99))
+
+    def test_regressions_against_the_baseline(self):
+        summary = {'requests': 10, 'errors': 0, 'p50': 10, 'p95': 20, 'p99': 30, 'queries_per_request': 4}
+        baseline = {'total': summary, 'steps': {'shop': summary}}
+        results = {
+            'total': dict(summary, p95=23),
+            'steps': {'shop': dict(summary, p95=30, queries_per_request=6), 'cart': summary},
+        }
+
+        self.assertEqual(
+            ['shop: p95 30 ms, baseline 20 ms', 'shop: 6 queries per request, baseline 4'],
+            loadtest.compare(results, baseline, tolerance=0.2),
+        )
+
+
+class CartMutationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.product = create_product('shirt', price=20, price_with_discount=15)
+
+    def test_adding_an_item_in_the_cart_takes_two_queries(self):
+        cart.add_item(self.user, self.product)
+        with CaptureQueriesContext(connection) as queries:
+            result = cart.add_item(self.user, self.product)
+
+        self.assertEqual(cart.QUANTITY_UPDATED, result)
+        self.assertLessEqual(count_statements(queries), 2)
+
+    def test_adding_a_new_line_takes_five_queries(self):
+        other = create_product('jeans', price=40)
+        for product in (self.product, other):
+            with CaptureQueriesContext(connection) as queries:
+                result = cart.add_item(self.user, product)
+
+            self.assertEqual(cart.ITEM_ADDED, result)
+            self.assertLessEqual(count_statements(queries), 5)
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual((55, 2), (order.sub_total, order.items_count))
+
+    def test_decreasing_an_item_takes_two_queries(self):
+        cart.add_item(self.user, self.product)
+        cart.add_item(self.user, self.product)
+        with CaptureQueriesContext(connection) as queries:
+            result = cart.decrease_item(self.user, self.product)
+
+        self.assertEqual(cart.QUANTITY_UPDATED, result)
+        self.assertLessEqual(count_statements(queries), 2)
+
+    def test_stored_totals_match_the_items(self):
+        other = create_product('jeans', price=40)
+        cart.add_item(self.user, self.product)
+        cart.add_item(self.user, self.product)
+        cart.add_item(self.user, other)
+        cart.decrease_item(self.user, self.product)
+        cart.remove_item(self.user, other)
+        cart.add_item(self.user, other)
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        totals = order.calculate_totals()
+        for field in Order.TOTAL_FIELDS:
+            self.assertAlmostEqual(totals[field], getattr(order, field))
+
+    def test_removing_the_last_unit_removes_the_line(self):
+        cart.add_item(self.user, self.product)
+
+        self.assertEqual(cart.ITEM_REMOVED, cart.decrease_item(self.user, self.product))
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(0, order.items_count)
+        self.assertFalse(order.products.exists())
+
+    def test_a_price_change_does_not_skew_the_totals(self):
+        cart.add_item(self.user, self.product, quantity=2)
+        Product.objects.filter(pk=self.product.pk).update(price_with_discount=30)
+        self.product.refresh_from_db()
+        cart.add_item(self.user, self.product)
+        cart.decrease_item(self.user, self.product)
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertAlmostEqual(30, order.sub_total)
+        cart.remove_item(self.user, self.product)
+        order.refresh_from_db()
+        self.assertEqual((0, 0, 0), (order.sub_total, order.total, order.items_count))
+
+    def test_mutating_without_a_cart(self):
+        self.assertEqual(cart.NO_ACTIVE_ORDER, cart.remove_item(self.user, self.product))
+        self.assertEqual(cart.NO_ACTIVE_ORDER, cart.decrease_item(self.user, self.product))
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.shirt = create_product('shirt', price=20, price_with_discount=15)
+        self.jeans = create_product('jeans', price=40)
+        for index in range(3):
+            user = User.objects.create_user(f'buyer-{index}')
+            cart.add_item(user, self.shirt, quantity=index + 1)
+            cart.add_item(user, self.jeans)
+        User.objects.create_user('empty').order_set.create()
+
+    def test_annotated_totals_match_the_items(self):
+        for order in Order.objects.with_totals():
+            totals = Order.objects.get(pk=order.pk).calculate_totals()
+            self.assertAlmostEqual(totals['sub_total'], order.get_sub_total())
+            self.assertAlmostEqual(totals['shipping_price'], order.get_shipping_price())
+            self.assertAlmostEqual(totals['total'], order.get_total_cart())
+            self.assertEqual(totals['items_count'], order.computed_items_count)
+
+    def test_listing_orders_with_totals_takes_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            totals = [order.get_total_cart() for order in Order.objects.with_totals()]
+
+        self.assertEqual(4, len(totals))
+        self.assertEqual(1, count_statements(queries))
+
+
+class OpenCartIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.product = create_product('shirt')
+        cart.add_item(self.user, self.product)
+
+    def test_a_user_has_one_open_cart(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user)
+
+        Order.objects.filter(user=self.user).update(ordered=True)
+        Order.objects.create(user=self.user)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'the partial indexes are matched by the PostgreSQL planner')
+    def test_cart_lookups_use_the_partial_indexes(self):
+        with connection.cursor() as cursor:
+            # the tables are tiny, a sequential scan would win on cost otherwise
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        order_plan = cart.get_open_orders(self.user).explain()
+        item_plan = OrderItem.objects.filter(user=self.user, product=self.product, ordered=False).explain()
+
+        self.assertIn('order_one_open_cart_per_user', order_plan)
+        self.assertIn('orderitem_open_idx', item_plan)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.product = create_product('shirt', price=20)
+
+    def place_orders(self, count):
+        for index in range(count):
+            user = User.objects.create_user(f'buyer{Order.objects.count()}')
+            cart.add_item(user, self.product, quantity=index + 1)
+            Order.objects.filter(user=user).update(ordered=True)
+
+    def get_changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:main_order_changelist'))
+        self.assertEqual(200, response.status_code)
+        return response, [query['sql'] for query in queries]
+
+    def test_totals_are_computed_for_the_shown_page_only(self):
+        self.place_orders(3)
+        with mock.patch.object(OrderAdmin, 'list_per_page', 2):
+            response, queries = self.get_changelist()
+
+        self.assertEqual(
+            [60, 40],
+            sorted((round(order.computed_sub_total) for order in response.context['cl'].result_list), reverse=True),
+        )
+        totals_queries = [sql for sql in queries if 'SUM(' in sql]
+        self.assertEqual(1, len(totals_queries))
+        self.assertIn('LIMIT', totals_queries[0])
+
+    def test_the_query_count_does_not_grow_with_the_orders(self):
+        self.place_orders(2)
+        _, few = self.get_changelist()
+        self.place_orders(8)
+        _, many = self.get_changelist()
+
+        self.assertEqual(len(few), len(many))
+
+    def test_estimated_counts_for_large_unfiltered_lists(self):
+        self.place_orders(3)
+        orders = Order.objects.order_by('pk')
+
+        with mock.patch('eshopper.main.pagination.get_estimated_count', return_value=50000):
+            self.assertEqual(50000, EstimatedCountPaginator(orders, 10).count)
+            # a filtered list has no estimate
+            self.assertEqual(3, EstimatedCountPaginator(orders.filter(ordered=True), 10).count)
+        with mock.patch('eshopper.main.pagination.get_estimated_count', return_value=100):
+            # small tables are counted exactly
+            self.assertEqual(3, EstimatedCountPaginator(orders, 10).count)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'reltuples is kept by PostgreSQL')
+    def test_estimated_count_reads_the_planner_statistics(self):
+        self.place_orders(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE main_order')
+
+        self.assertEqual(Order.objects.count(), get_estimated_count(Order.objects.all()))
+
+
+class MergeDuplicateCartsMigrationTests(TransactionTestCase):
+    migrate_from = ('main', '0021_admin_filter_indexes')
+    migrate_to = ('main', '0022_open_cart_constraints')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_carts_sharing_a_product_are_merged_into_one_line(self):
+        apps = self.migrate(self.migrate_from)
+        Order = apps.get_model('main', 'Order')
+        OrderItem = apps.get_model('main', 'OrderItem')
+        user = apps.get_model('auth', 'User').objects.create(username='buyer')
+        shirt, jeans = (
+            apps.get_model('main', 'Product').objects.create(
+                name=slug, slug=slug, categories='shirts', sizes='M', price=price, description=slug,
+            )
+            for slug, price in (('shirt', 20), ('jeans', 40))
+        )
+        first, second = Order.objects.create(user=user), Order.objects.create(user=user)
+        first.products.add(OrderItem.objects.create(user=user, product=shirt, quantity=2))
+        second.products.add(
+            OrderItem.objects.create(user=user, product=shirt, quantity=3),
+            OrderItem.objects.create(user=user, product=jeans, quantity=1),
+        )
+
+        apps = self.migrate(self.migrate_to)
+        order = apps.get_model('main', 'Order').objects.get()
+        self.assertEqual(first.pk, order.pk)
+        self.assertEqual(
+            {('shirt', 5), ('jeans', 1)},
+            set(order.products.values_list('product__slug', 'quantity')),
+        )
+        self.assertEqual(2, apps.get_model('main', 'OrderItem').objects.count())
+        self.assertEqual((140, 2), (order.sub_total, order.items_count))
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.client.force_login(self.user)
+        self.shirt = create_product('shirt', price=20, price_with_discount=15)
+        self.jeans = create_product('jeans', price=40)
+        cart.add_item(self.user, self.shirt, quantity=2)
+        cart.add_item(self.user, self.jeans)
+
+    def submit(self, **data):
+        return self.client.post(reverse('checkout'), {**loadtest.CHECKOUT_DATA, **data})
+
+    def test_placing_an_order_snapshots_and_closes_the_cart(self):
+        self.submit(idempotency_key='first')
+        Product.objects.filter(pk=self.shirt.pk).update(price_with_discount=5)
+
+        order = Order.objects.with_totals().get(user=self.user)
+        self.assertTrue(order.ordered)
+        self.assertEqual('first', order.idempotency_key)
+        self.assertAlmostEqual(70, order.sub_total)
+        self.assertAlmostEqual(70, order.computed_sub_total)
+        self.assertEqual(2, order.items_count)
+        self.assertFalse(OrderItem.objects.filter(user=self.user, ordered=False).exists())
+        self.assertEqual(
+            {('shirt', 15), ('jeans', 40)},
+            set(order.products.values_list('product_name', 'unit_price')),
+        )
+        self.assertEqual(order, ShippingAddress.objects.get().order)
+
+    def test_a_retried_submission_returns_the_placed_order(self):
+        self.submit(idempotency_key='retry')
+        response = self.submit(idempotency_key='retry')
+
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(1, Order.objects.filter(user=self.user).count())
+        self.assertEqual(1, ShippingAddress.objects.count())
+
+    def test_checking_out_without_items_fails(self):
+        Order.objects.filter(user=self.user).update(ordered=True)
+        with self.assertRaises(CheckoutError):
+            place_order(self.user, ShippingAddress(**loadtest.CHECKOUT_DATA))
+
+        Order.objects.create(user=self.user)
+        with self.assertRaises(CheckoutError):
+            place_order(self.user, ShippingAddress(**loadtest.CHECKOUT_DATA))
+        self.assertFalse(ShippingAddress.objects.exists())
+
+    def test_deleting_a_product_takes_it_out_of_the_carts(self):
+        self.jeans.delete()
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual((30, 1), (order.sub_total, order.items_count))
+        self.assertAlmostEqual(30.3, order.total)
+        self.assertFalse(OrderItem.objects.filter(product=None).exists())
+        self.assertContains(self.client.get(reverse('cart')), 'shirt')
+
+    def test_lines_without_a_product_are_shown_and_dropped(self):
+        # lines whose product was deleted before carts were cleaned up on deletion
+        OrderItem.objects.filter(product=self.jeans).update(product=None)
+
+        self.assertContains(self.client.get(reverse('cart')), 'no longer available')
+        order = place_order(self.user, ShippingAddress(**loadtest.CHECKOUT_DATA))
+        self.assertEqual(['shirt'], list(order.products.values_list('product_name', flat=True)))
+        self.assertAlmostEqual(30, order.sub_total)
+
+    def test_idempotency_keys_are_scoped_to_the_user(self):
+        self.submit(idempotency_key='shared')
+        other = User.objects.create_user('other')
+        cart.add_item(other, self.shirt)
+
+        order = place_order(other, ShippingAddress(**loadtest.CHECKOUT_DATA), 'shared')
+        self.assertEqual(other, order.user)
+        self.assertEqual(2, Order.objects.filter(idempotency_key='shared').count())
+
+    def test_an_invalid_address_renders_the_form_again(self):
+        response = self.submit(email='not an email', idempotency_key='kept')
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual('kept', response.context['idempotency_key'])
+        self.assertFalse(Order.objects.get(user=self.user).ordered)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.client.force_login(self.user)
+        create_product('shirt')
+
+    def test_catalog_reads_of_a_request_go_to_the_replica_until_it_writes(self):
+        self.assertEqual('default', router.db_for_read(Product))
+
+        with routers.route_reads('replica') as state:
+            self.assertEqual('replica', router.db_for_read(Product))
+            self.assertEqual('default', router.db_for_read(Order))
+            self.assertEqual('default', router.db_for_read(User))
+
+            self.assertEqual('default', router.db_for_write(OrderItem))
+            self.assertTrue(state.wrote)
+            self.assertEqual('default', router.db_for_read(Product))
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(router.allow_migrate('replica', 'main', model_name='product'))
+        self.assertTrue(router.allow_migrate('default', 'main', model_name='product'))
+
+    def test_a_client_that_wrote_is_pinned_to_the_primary(self):
+        response = self.client.post(
+            reverse('cart_api'),
+            data=json.dumps({'operations': [{'slug': 'shirt', 'delta': 1}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(10, response.cookies[routers.PRIMARY_PIN_COOKIE]['max-age'])
+
+        # the replica is not open to this test case, a read routed to it would fail
+        self.assertEqual(200, self.client.get(reverse('shop')).status_code)
+
+
+@unittest.skipUnless('replica' in settings.DATABASES, 'run with eshopper.test_settings for the replica alias')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaReadTests(TransactionTestCase):
+    # the replica of eshopper.test_settings
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        caching.local_products.clear()
+        self.product = create_product('shirt')
+
+    def count_replica_queries(self, function, *args):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            function(*args)
+        return len(queries)
+
+    def test_signed_in_catalog_pages_read_from_the_replica(self):
+        self.client.force_login(User.objects.create_user('buyer'))
+
+        self.assertGreater(self.count_replica_queries(self.client.get, reverse('shop')), 0)
+
+    def test_cache_refills_read_from_the_primary(self):
+        with routers.route_reads('replica'):
+            self.assertEqual(0, self.count_replica_queries(caching.get_product, 'shirt'))
+            self.assertEqual(0, self.count_replica_queries(related.build_bucket, 'shirts', 'M'))
+        self.assertEqual('default', caching.get_product('shirt')._state.db)
+
+    def test_anonymous_pages_are_cached_from_the_primary(self):
+        url = reverse('shop_category', args=['shirts'])
+
+        self.assertEqual(0, self.count_replica_queries(self.client.get, url))
+        self.assertEqual('hit', self.client.get(url)['X-Page-Cache'])
+
+    def test_admin_changelists_read_from_the_replica_and_edits_from_the_primary(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+        def get(name, *args):
+            # each request starts unpinned, as if the one before had not written
+            self.client.cookies.pop(routers.PRIMARY_PIN_COOKIE, None)
+            return self.count_replica_queries(self.client.get, reverse(f'admin:main_product_{name}', args=args))
+
+        self.assertGreater(get('changelist'), 0)
+        self.assertEqual(0, get('change', self.product.pk))
+        self.assertEqual(0, get('delete', self.product.pk))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.usable = True
+        self.closed = False
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def create_pool(self, **kwargs):
+        return ConnectionPool(
+            check=lambda connection: connection.usable,
+            reset=lambda connection: not connection.closed,
+            close=lambda connection: setattr(connection, 'closed', True),
+            **kwargs,
+        )
+
+    def test_released_connections_are_reused(self):
+        pool = self.create_pool(max_size=2)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+
+        self.assertIs(first, pool.acquire(FakeConnection))
+        self.assertEqual({'created': 1, 'reused': 1, 'in_use': 1}, {
+            key: value for key, value in pool.get_stats().items() if key in ('created', 'reused', 'in_use')
+        })
+
+    def test_a_full_pool_waits_and_times_out(self):
+        pool = self.create_pool(max_size=1, timeout=0.05)
+        connection = pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+
+        threading.Timer(0.01, pool.release, [connection]).start()
+        pool.timeout = 5
+        self.assertIs(connection, pool.acquire(FakeConnection))
+        stats = pool.get_stats()
+        self.assertEqual((2, 1), (stats['waits'], stats['timeouts']))
+
+    def test_dead_and_broken_connections_are_replaced(self):
+        pool = self.create_pool(max_size=1, check_after=0)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        connection.usable = False
+
+        replacement = pool.acquire(FakeConnection)
+        self.assertIsNot(connection, replacement)
+        self.assertTrue(connection.closed)
+
+        replacement.closed = True
+        pool.release(replacement)
+        stats = pool.get_stats()
+        self.assertEqual((1, 2, 0), (stats['failed_checks'], stats['discarded'], stats['size']))
+
+    def test_a_failed_connect_frees_its_slot(self):
+        pool = self.create_pool(max_size=1, timeout=0)
+
+        def connect():
+            raise OSError('connection refused')
+
+        with self.assertRaises(OSError):
+            pool.acquire(connect)
+        self.assertIsInstance(pool.acquire(FakeConnection), FakeConnection)
+
+
+class FakePostgresConnection:
+    def __init__(self, status=TRANSACTION_STATUS_IDLE, rollback_error=None):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=status)
+        self.rollback_error = rollback_error
+        self.rolled_back = False
+
+    def rollback(self):
+        if self.rollback_error:
+            raise self.rollback_error
+        self.rolled_back = True
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class PooledBackendTests(SimpleTestCase):
+    def test_returned_connections_are_rolled_back_or_discarded(self):
+        idle = FakePostgresConnection()
+        self.assertTrue(postgresql_pool.reset_connection(idle))
+        self.assertFalse(idle.rolled_back)
+
+        in_transaction = FakePostgresConnection(TRANSACTION_STATUS_INTRANS)
+        self.assertTrue(postgresql_pool.reset_connection(in_transaction))
+        self.assertTrue(in_transaction.rolled_back)
+
+        closed = FakePostgresConnection()
+        closed.closed = 1
+        broken = FakePostgresConnection(TRANSACTION_STATUS_UNKNOWN)
+        failed_rollback = FakePostgresConnection(
+            TRANSACTION_STATUS_INERROR, rollback_error=postgresql_pool.Database.OperationalError(),
+        )
+        for returned in (closed, broken, failed_rollback):
+            self.assertFalse(postgresql_pool.reset_connection(returned))
+
+    def test_a_broken_connection_fails_the_check(self):
+        connection = mock.Mock()
+        connection.cursor.side_effect = postgresql_pool.Database.OperationalError()
+
+        self.assertFalse(postgresql_pool.check_connection(connection))
+
+    def test_a_forked_worker_starts_with_no_pools(self):
+        inherited = FakePostgresConnection()
+        pool = ConnectionPool(check=bool, reset=bool, close=mock.Mock())
+        pool.release(pool.acquire(lambda: inherited))
+        self.addCleanup(postgresql_pool._inherited_connections.clear)
+
+        with mock.patch.dict(postgresql_pool._pools, {('default', 'eshopper_db'): pool}):
+            postgresql_pool._reset_after_fork()
+            self.assertEqual({}, postgresql_pool._pools)
+
+        # kept open, the parent still uses its socket
+        self.assertIn(inherited, postgresql_pool._inherited_connections)
+        pool.close.assert_not_called()
+
+
+class UlidTests(SimpleTestCase):
+    def test_ids_are_26_crockford_characters(self):
+        for _ in range(100):
+            ulid = ids.new_ulid()
+            self.assertEqual(ids.LENGTH, len(ulid))
+            self.assertLessEqual(set(ulid), set(ids.ENCODING))
+
+    def test_ids_of_one_millisecond_increase(self):
+        # a fresh sequence, so that later ids do not continue from the frozen clock
+        with mock.patch.multiple(ids, _last_timestamp=-1, _last_random=0), \
+                mock.patch('time.time_ns', return_value=1_700_000_000_000 * 1_000_000):
+            generated = [ids.new_ulid() for _ in range(1000)]
+
+        self.assertEqual(sorted(generated), generated)
+        self.assertEqual(len(generated), len(set(generated)))
+        self.assertEqual({1_700_000_000_000}, {ids.decode_timestamp(ulid) for ulid in generated})
+
+    def test_the_timestamp_leads(self):
+        earlier, later = ids.new_ulid(1_000), ids.new_ulid(1_001)
+
+        self.assertLess(earlier, later)
+        self.assertEqual(1_001, ids.decode_timestamp(later))
+
+    def test_the_migration_copy_encodes_the_same(self):
+        migration = importlib.import_module('eshopper.main.migrations.0020_order_transaction_id_ulid')
+
+        self.assertEqual(ids.ENCODING, migration.ENCODING)
+        with mock.patch('os.urandom', return_value=bytes(range(10))):
+            self.assertEqual(ids.new_ulid(1_650_000_000_123), migration.ulid_at(1_650_000_000_123))
+
+
+class StaticFilesTests(SimpleTestCase):
+    STYLESHEET = b'body { color: #333; }\n' * 200
+
+    def setUp(self):
+        source = tempfile.TemporaryDirectory()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        source_storage = FileSystemStorage(location=source.name)
+        source_storage.save('css/app.css', ContentFile(self.STYLESHEET))
+
+        self.storage = CompressedManifestStaticFilesStorage(location=root.name, base_url='/static/')
+        self.storage.save('css/app.css', ContentFile(self.STYLESHEET))
+        list(self.storage.post_process({'css/app.css': (source_storage, 'css/app.css')}))
+        self.hashed_name = self.storage.stored_name('css/app.css')
+
+        with override_settings(STATIC_ROOT=root.name, STATIC_URL='/static/'):
+            self.middleware = StaticFilesMiddleware(lambda request: HttpResponse(status=404))
+
+    def get(self, name, accept_encoding=''):
+        request = RequestFactory().get(f'/static/{name}', HTTP_ACCEPT_ENCODING=accept_encoding)
+        response = self.middleware(request)
+        self.addCleanup(response.close)
+        return response
+
+    def test_text_assets_get_compressed_siblings(self):
+        self.assertNotEqual('css/app.css', self.hashed_name)
+        with self.storage.open(f'{self.hashed_name}.gz') as compressed:
+            self.assertEqual(self.STYLESHEET, gzip.decompress(compressed.read()))
+        if storage.brotli is not None:
+            self.assertTrue(self.storage.exists(f'{self.hashed_name}.br'))
+
+    def test_the_accepted_encoding_is_served(self):
+        cases = [
+            ('gzip, deflate, br', 'br' if storage.brotli is not None else 'gzip'),
+            ('gzip', 'gzip'),
+            ('br;q=0, gzip', 'gzip'),
+            ('identity', None),
+            ('', None),
+        ]
+        for accept_encoding, expected in cases:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get(self.hashed_name, accept_encoding)
+
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(expected, response.get('Content-Encoding'))
+                self.assertEqual('Accept-Encoding', response['Vary'])
+                content = b''.join(response.streaming_content)
+                self.assertEqual(int(response['Content-Length']), len(content))
+                if expected is None:
+                    self.assertEqual(self.STYLESHEET, content)
+
+    def test_only_hashed_names_are_immutable(self):
+        self.assertEqual(StaticFilesMiddleware.IMMUTABLE_CACHE_CONTROL, self.get(self.hashed_name)['Cache-Control'])
+        self.assertEqual(StaticFilesMiddleware.CACHE_CONTROL, self.get('css/app.css')['Cache-Control'])
+
+    def test_other_paths_are_passed_on(self):
+        self.assertEqual(404, self.get('css/missing.css').status_code)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.product = create_product('shirt')
+
+    def save_image(self, name):
+        buffer = io.BytesIO()
+        Image.new('RGB', (500, 300), 'navy').save(buffer, 'JPEG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def set_image(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.image = name
+            self.product.save()
+        self.product.refresh_from_db()
+
+    def test_replaced_images_lose_their_variants(self):
+        self.set_image(self.save_image('first.jpg'))
+        self.assertEqual([100, 400], self.product.image_variants)
+
+        self.set_image(self.save_image('second.jpg'))
+        self.assertFalse(default_storage.exists(images.get_variant_name('first.jpg', 100)))
+        self.assertTrue(default_storage.exists(images.get_variant_name('second.jpg', 100)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(default_storage.exists(images.get_variant_name('second.jpg', 100, 'webp')))
+
+    def test_an_unreadable_upload_does_not_fail_the_save(self):
+        default_storage.save('broken.jpg', ContentFile(b'not an image'))
+
+        with self.assertLogs('eshopper.main.signals', 'ERROR'):
+            self.set_image('broken.jpg')
+        self.assertEqual([], self.product.image_variants)
+
+
+class CartApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.client.force_login(self.user)
+        self.shirt = create_product('shirt', price=20)
+        self.jeans = create_product('jeans', price=50, price_with_discount=40)
+
+    def post_operations(self, operations):
+        return self.client.post(
+            reverse('cart_api'),
+            data=json.dumps({'operations': operations}),
+            content_type='application/json',
+        )
+
+    def test_batch_is_applied_and_the_cart_returned(self):
+        response = self.post_operations([
+            {'slug': 'shirt', 'delta': 3},
+            {'slug': 'jeans', 'delta': 1},
+            {'slug': 'shirt', 'delta': -1},
+        ])
+
+        self.assertEqual(200, response.status_code)
+        data = response.json()['cart']
+        self.assertEqual(
+            [('shirt', 2, 40), ('jeans', 1, 40)],
+            sorted([(item['slug'], item['quantity'], item['total']) for item in data['items']], reverse=True),
+        )
+        self.assertAlmostEqual(80, data['sub_total'])
+        self.assertEqual(2, data['items_count'])
+
+    def test_lines_and_totals_keep_the_added_price(self):
+        self.post_operations([{'slug': 'shirt', 'delta': 2}])
+        Product.objects.filter(pk=self.shirt.pk).update(price=50)
+
+        data = self.post_operations([{'slug': 'jeans', 'delta': 1}]).json()['cart']
+        self.assertAlmostEqual(sum(item['total'] for item in data['items']), data['sub_total'])
+        self.assertAlmostEqual(80, data['sub_total'])
+
+        self.client.post(reverse('checkout'), loadtest.CHECKOUT_DATA)
+        self.assertAlmostEqual(80, Order.objects.get(user=self.user).sub_total)
+
+    def test_remove_drops_the_line(self):
+        self.post_operations([{'slug': 'shirt', 'delta': 2}, {'slug': 'jeans', 'delta': 1}])
+
+        data = self.post_operations([{'slug': 'shirt', 'remove': True}]).json()['cart']
+
+        self.assertEqual(['jeans'], [item['slug'] for item in data['items']])
+        self.assertAlmostEqual(40, data['sub_total'])
+
+    def test_lines_without_a_product_are_flagged(self):
+        self.post_operations([{'slug': 'shirt', 'delta': 1}, {'slug': 'jeans', 'delta': 1}])
+        OrderItem.objects.filter(product=self.jeans).update(product=None, product_name='jeans')
+
+        response = self.client.get(reverse('cart_api'))
+        self.assertEqual(200, response.status_code)
+        self.assertCountEqual(
+            [('shirt', 'shirt', True), (None, 'jeans', False)],
+            [(item['slug'], item['name'], item['available']) for item in response.json()['cart']['items']],
+        )
+
+    def test_unknown_product_rejects_the_whole_batch(self):
+        response = self.post_operations([{'slug': 'shirt', 'delta': 1}, {'slug': 'missing', 'delta': 1}])
+
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+    def test_anonymous_users_are_rejected(self):
+        self.client.logout()
+
+        self.assertEqual(401, self.post_operations([{'slug': 'shirt', 'delta': 1}]).status_code)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    CLICKS = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads cannot share an in-memory SQLite database')
+        self.user = User.objects.create_user('buyer')
+
+    def hammer(self, target, count):
+        barrier = threading.Barrier(count)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                target(index)
+            except Exception as error:  # collected so the test fails instead of the thread
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+    def test_concurrent_clicks_do_not_lose_increments(self):
+        product = create_product('shirt', price=10)
+        cart.add_item(self.user, product)
+
+        def click(index):
+            for _ in range(self.CLICKS):
+                cart.add_item(self.user, product)
+
+        self.hammer(click, self.THREADS)
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        expected_quantity = 1 + self.THREADS * self.CLICKS
+        self.assertEqual(expected_quantity, OrderItem.objects.get(user=self.user).quantity)
+        self.assertAlmostEqual(expected_quantity * 10, order.sub_total)
+        self.assertEqual(1, order.items_count)
+
+    def test_concurrent_first_adds_open_a_single_cart(self):
+        products = [create_product(f'product-{index}', price=10) for index in range(self.THREADS)]
+
+        self.hammer(lambda index: cart.add_item(self.user, products[index]), self.THREADS)
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(self.THREADS, order.items_count)
+        self.assertEqual(self.THREADS, order.products.count())
+        self.assertAlmostEqual(self.THREADS * 10, order.sub_total)
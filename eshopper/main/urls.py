@@ -2,8 +2,7 @@ from django.urls import path
 
 from eshopper.main.views import HomeView, UserRegisterView, UserLoginView, ProfileDetailsView, \
     UserLogoutView, ProductDetailsView, add_to_cart, OrderSummaryView, remove_from_cart, \
-    decrease_quantity_of_item_from_cart, CheckoutView, shop, contact, shop_only_shirts, shop_only_dresses, \
-    shop_only_jeans, shop_only_jackets
+    decrease_quantity_of_item_from_cart, CheckoutView, shop, contact, shop_category, cart_api
 
 urlpatterns = [
     path('', HomeView.as_view(), name='index'),
@@ -12,10 +11,7 @@ urlpatterns = [
     path('logout/', UserLogoutView.as_view(), name='logout'),
     path('profile/<int:pk>/', ProfileDetailsView.as_view(), name='profile'),
     path('shop/', shop, name='shop'),
-    path('shop/shirts/', shop_only_shirts, name='shop_only_shirts'),
-    path('shop/dresses/', shop_only_dresses, name='shop_only_dresses'),
-    path('shop/jeans/', shop_only_jeans, name='shop_only_jeans'),
-    path('shop/jackets/', shop_only_jackets, name='shop_only_jackets'),
+    path('shop/<str:category>/', shop_category, name='shop_category'),
     path('contact/', contact, name='contact'),
     path('product/<slug>/', ProductDetailsView.as_view(), name='product_details'),
     path('cart/', OrderSummaryView.as_view(), name='cart'),
@@ -24,5 +20,26 @@ urlpatterns = [
     path('remove_from_cart/<slug>', remove_from_cart, name='remove_from_cart'),
     path('decrease-quantity-of-item-from-cart/<slug>', decrease_quantity_of_item_from_cart,
          name='decrease_quantity_of_item_from_cart'),
+    path('api/cart/', cart_api, name='cart_api'),
 
 ]
+
+# Most statements (transaction control included) each page may run for a signed in user with a
+# cart; QueryBudgetMixin holds the tests to them
+QUERY_BUDGETS = {
+    'index': 4,
+    'register': 4,
+    'login': 4,
+    'logout': 4,
+    'profile': 4,
+    'shop': 8,
+    'shop_category': 7,
+    'contact': 4,
+    'product_details': 8,
+    'cart': 5,
+    'checkout': 5,
+    'add_to_cart': 10,
+    'remove_from_cart': 8,
+    'decrease_quantity_of_item_from_cart': 8,
+    'cart_api': 24,
+}
@@ -1,21 +1,43 @@
+import json
+import uuid
+
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import render, redirect, get_object_or_404
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404, JsonResponse, QueryDict
+from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
 from django.views import View
+from django.views.decorators.http import require_http_methods
 from django.views.generic import CreateView, TemplateView, DetailView
 
+from eshopper.main import cart
+from eshopper.main.caching import (
+    SEARCH_SURROGATE_KEY,
+    add_surrogate_keys,
+    anonymous_page_cache,
+    category_surrogate_key,
+    get_cached_category_grid,
+    get_product,
+    product_surrogate_key,
+    set_cached_category_grid,
+)
+from eshopper.main.checkout import CheckoutError, place_order
+from eshopper.main.conditional import ALL_CATEGORIES, conditional_catalog_page
 from eshopper.main.forms import CreateProfileForm, CheckoutForm, ContactForm
-from eshopper.main.models import Customer, Product, Order, OrderItem
-
-
-def is_valid_queryparam(param):
-    return param != '' and param is not None
+from eshopper.main.middleware import reset_cart
+from eshopper.main.models import Customer, Product
+from eshopper.main.pagination import get_valid_cursor, paginate
+from eshopper.main.related import get_related_products
+from eshopper.main.search import FACETS, ProductSearch
 
 
+@anonymous_page_cache
 class HomeView(TemplateView):
     template_name = 'index.html'
 
@@ -52,94 +74,70 @@ class ProfileDetailsView(DetailView):
     context_object_name = 'profile'
 
 
-def filter(request):
-    qs = Product.objects.all().order_by('price_with_discount', 'price')
-    name_contains_query = request.GET.get('name_contains')
-    price_until_hundred = request.GET.get('price_until_hundred')
-    price_until_two_hundred = request.GET.get('price_until_two_hundred')
-    price_until_three_hundred = request.GET.get('price_until_three_hundred')
-    price_until_four_hundred = request.GET.get('price_until_four_hundred')
-    price_until_five_hundred = request.GET.get('price_until_five_hundred')
-    size_xs = request.GET.get('size_xs')
-    size_s = request.GET.get('size_s')
-    size_m = request.GET.get('size_m')
-    size_l = request.GET.get('size_l')
-    size_xl = request.GET.get('size_xl')
-
-    if is_valid_queryparam(name_contains_query):
-        qs = qs.filter(name__icontains=name_contains_query)
-
-    if is_valid_queryparam(price_until_hundred):
-        qs = qs.filter(price__range=(0, 100))
-
-    elif is_valid_queryparam(price_until_two_hundred):
-        qs = qs.filter(price__range=(100, 200))
-
-    elif is_valid_queryparam(price_until_three_hundred):
-        qs = qs.filter(price__range=(200, 300))
-
-    elif is_valid_queryparam(price_until_four_hundred):
-        qs = qs.filter(price__range=(300, 400))
-
-    elif is_valid_queryparam(price_until_five_hundred):
-        qs = qs.filter(price__range=(400, 500))
-
-    if is_valid_queryparam(size_xs):
-        qs = qs.filter(sizes__exact='XS')
-
-    elif is_valid_queryparam(size_s):
-        qs = qs.filter(sizes__exact='S')
-
-    elif is_valid_queryparam(size_m):
-        qs = qs.filter(sizes__exact='M')
-
-    elif is_valid_queryparam(size_l):
-        qs = qs.filter(sizes__exact='L')
-
-    elif is_valid_queryparam(size_xl):
-        qs = qs.filter(sizes__exact='XL')
-
-    return qs
+def get_shop_products(request):
+    return Product.objects.all(), ALL_CATEGORIES
 
 
+@anonymous_page_cache
+@conditional_catalog_page(get_shop_products)
 def shop(request):
-    qs = filter(request)
+    search = ProductSearch(request.GET)
+    page = paginate(request, search.get_queryset(), search.get_ordering())
     context = {
-        'queryset': qs,
+        'queryset': page,
+        'facets': search.get_facets(),
+        'name_contains': search.name_contains or '',
     }
+    # the facet counts cover every category
+    add_surrogate_keys(
+        request,
+        *(category_surrogate_key(category) for category, _ in Product.CATEGORIES),
+        *(product_surrogate_key(product.pk) for product in page),
+    )
+    if search.is_text_search():
+        add_surrogate_keys(request, SEARCH_SURROGATE_KEY)
     return render(request, 'shop.html', context)
 
 
-def shop_only_shirts(request):
-    qs = Product.objects.filter(categories__exact='shirts').order_by('-price_with_discount', 'price')
-    context = {
-        'queryset': qs,
-    }
-    return render(request, 'shop_only_shirts.html', context)
+CATEGORY_ORDERING = ('effective_price',)
 
 
-def shop_only_dresses(request):
-    qs = Product.objects.filter(categories__exact='dresses').order_by('-price_with_discount', 'price')
-    context = {
-        'queryset': qs,
-    }
-    return render(request, 'shop_only_dresses.html', context)
+def get_category_products(request, category):
+    if category not in dict(Product.CATEGORIES):
+        return None
+    return Product.objects.filter(categories=category), category
 
 
-def shop_only_jeans(request):
-    qs = Product.objects.filter(categories__exact='jeans').order_by('-price_with_discount', 'price')
-    context = {
-        'queryset': qs,
-    }
-    return render(request, 'shop_only_jeans.html', context)
+@anonymous_page_cache
+@conditional_catalog_page(get_category_products)
+def shop_category(request, category):
+    categories = dict(Product.CATEGORIES)
+    if category not in categories:
+        raise Http404('No such category')
 
+    qs = Product.objects.using(DEFAULT_DB_ALIAS).filter(categories__exact=category)
+    # cursors are signed, so only the pages the listing linked to get a cache entry
+    cursor = get_valid_cursor(request, qs, CATEGORY_ORDERING)
+    product_grid = get_cached_category_grid(category, cursor)
+    if product_grid is None:
+        page = paginate(request, qs, CATEGORY_ORDERING, params=QueryDict())
+        html = render_to_string('product_grid.html', {'queryset': page})
+        product_ids = [product.pk for product in page]
+        set_cached_category_grid(category, cursor, html, product_ids)
+        product_grid = {'html': html, 'product_ids': product_ids}
 
-def shop_only_jackets(request):
-    qs = Product.objects.filter(categories__exact='jackets').order_by('-price_with_discount', 'price')
+    add_surrogate_keys(
+        request,
+        category_surrogate_key(category),
+        *(product_surrogate_key(pk) for pk in product_grid['product_ids']),
+    )
     context = {
-        'queryset': qs,
+        'category': category,
+        'category_name': categories[category],
+        'facets': [facet for facet in FACETS if facet.param != 'category'],
+        'product_grid': mark_safe(product_grid['html']),
     }
-    return render(request, 'shop_only_jackets.html', context)
+    return render(request, 'shop_category.html', context)
 
 
 # class ShopView(ListView):
@@ -149,73 +147,167 @@ def shop_only_jackets(request):
 #     paginate_by = 5
 
 
+def get_product_or_404(slug):
+    product = get_product(slug)
+    if product is None:
+        raise Http404('No product found matching the query')
+    return product
+
+
+def get_detail_products(request, slug):
+    # the page shows the product and related products ranked within its category
+    product = get_product(slug)
+    if product is None:
+        return None
+    return Product.objects.filter(categories=product.categories), product.categories
+
+
+@anonymous_page_cache
+@method_decorator(conditional_catalog_page(get_detail_products), name='get')
 class ProductDetailsView(DetailView):
     model = Product
     template_name = 'product_detail.html'
 
+    def get_object(self, queryset=None):
+        return get_product_or_404(self.kwargs['slug'])
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        # add extra field
-        context['products'] = Product.objects.all()
+        context['products'] = get_related_products(self.object)
+        # the related products are ranked within the category
+        add_surrogate_keys(
+            self.request,
+            product_surrogate_key(self.object.pk),
+            category_surrogate_key(self.object.categories),
+            *(product_surrogate_key(product.pk) for product in context['products']),
+        )
         return context
 
 
 class OrderSummaryView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
-        try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
-            context = {
-                'object': order
-            }
-            return render(self.request, 'cart.html', context)
-        except ObjectDoesNotExist:
+        order = self.request.cart
+        if not order:
             messages.warning(self.request, "You do not have an active order")
             return redirect('index')
+        context = {
+            'object': order
+        }
+        return render(self.request, 'cart.html', context)
 
 
-class CheckoutView(View):
+class CheckoutView(LoginRequiredMixin, View):
 
     def get(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
-        form = CheckoutForm()
+        order = self.request.cart
+        if not order:
+            messages.warning(self.request, "You do not have an active order")
+            return redirect('index')
+        return self.render_form(order, CheckoutForm(), uuid.uuid4().hex)
+
+    def post(self, *args, **kwargs):
+        form = CheckoutForm(self.request.POST)
+        idempotency_key = self.request.POST.get('idempotency_key', '')[:64]
+        if not form.is_valid():
+            order = self.request.cart
+            if not order:
+                messages.warning(self.request, "You do not have an active order")
+                return redirect('index')
+            return self.render_form(order, form, idempotency_key or uuid.uuid4().hex)
+
+        try:
+            place_order(self.request.user, form.save(commit=False), idempotency_key)
+        except CheckoutError as error:
+            messages.warning(self.request, str(error))
+            return redirect('index')
+        finally:
+            reset_cart(self.request)
+        messages.success(self.request, "Your order was placed")
+        return redirect('index')
+
+    def render_form(self, order, form, idempotency_key):
         context = {
             'form': form,
             'order': order,
+            'idempotency_key': idempotency_key,
         }
         return render(self.request, 'checkout.html', context)
 
-    def post(self, *args, **kwargs):
-        form = CheckoutForm(self.request.POST)
-        if form.is_valid():
-            form.save()
-            return redirect('index')
+
+MAX_CART_OPERATIONS = 100
+
+CART_MESSAGES = {
+    cart.ITEM_ADDED: 'This item was added to your cart',
+    cart.QUANTITY_UPDATED: 'The quantity of this item was updated',
+    cart.ITEM_REMOVED: 'This item was removed from your cart',
+    cart.NOT_IN_CART: 'The item was not in your cart',
+    cart.NO_ACTIVE_ORDER: 'You do not have an active order',
+}
+
+
+def get_cart_changes(body):
+    """
+    Read ``{"operations": [{"slug": ..., "delta": ...}, ...]}`` into ``(product, delta)`` pairs,
+    loading all products with one query. ``"remove": true`` in place of a delta drops the line.
+    """
+    try:
+        operations = json.loads(body)['operations']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Expected a JSON object with a list of operations')
+    if not isinstance(operations, list) or len(operations) > MAX_CART_OPERATIONS:
+        raise ValueError(f'Expected a list of at most {MAX_CART_OPERATIONS} operations')
+
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get('slug'), str):
+            raise ValueError('Every operation needs a product slug')
+        delta = operation.get('delta')
+        if operation.get('remove') is True:
+            operation['delta'] = None
+        elif isinstance(delta, bool) or not isinstance(delta, int):
+            raise ValueError('Every operation needs an integer delta or "remove": true')
+
+    slugs = {operation['slug'] for operation in operations}
+    products = {product.slug: product for product in Product.objects.filter(slug__in=slugs)}
+    missing = [operation['slug'] for operation in operations if operation['slug'] not in products]
+    if missing:
+        raise ValueError(f'Unknown products: {", ".join(sorted(set(missing)))}')
+    return [
+        (products[operation['slug']], operation['delta'])
+        for operation in operations if operation['delta'] != 0
+    ]
+
+
+@require_http_methods(['GET', 'POST'])
+def cart_api(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'You are not logged in'}, status=401)
+
+    results = []
+    if request.method == 'POST':
+        try:
+            changes = get_cart_changes(request.body)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        results = [
+            {'slug': product.slug, 'result': result}
+            for (product, _), result in zip(changes, cart.apply_changes(request.user, changes))
+        ]
+        reset_cart(request)
+
+    return JsonResponse({
+        'cart': cart.serialize_cart(request.cart),
+        'results': results,
+    })
 
 
 def add_to_cart(request, slug):
     if not request.user.is_authenticated:
         messages.warning(request, 'You are not logged in')
         return redirect('shop')
-    product = get_object_or_404(Product, slug=slug)
-    order_product, created = OrderItem.objects.get_or_create(
-        product=product,
-        user=request.user,
-        ordered=False,
-    )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.products.filter(product__slug=product.slug).exists():
-            order_product.quantity += 1
-            order_product.save()
-            messages.info(request, 'The quantity of this item was updated')
-        else:
-            messages.info(request, 'This item was added to your cart')
-            order.products.add(order_product)
-        return redirect('cart')
-    else:
-        order = Order.objects.create(user=request.user)
-        order.products.add(order_product)
-        messages.info(request, 'This item was added to your cart')
+    product = get_product_or_404(slug)
+    result = cart.change_quantity(request.user, product, 1)
+    reset_cart(request)
+    messages.info(request, CART_MESSAGES[result])
     return redirect('cart')
 
 
@@ -223,50 +315,21 @@ def remove_from_cart(request, slug):
     if not request.user.is_authenticated:
         messages.warning(request, 'You are not logged in')
         return redirect('shop')
-    product = get_object_or_404(Product, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.products.filter(product__slug=product.slug).exists():
-            order_product = OrderItem.objects.filter(
-                product=product,
-                user=request.user,
-                ordered=False,
-            )[0]
-            messages.info(request, 'This item was removed from your cart')
-            order.products.remove(order_product)
-        else:
-            messages.info(request, 'The item was not in your cart')
-        return redirect('cart')
-    else:
-        messages.info(request, 'You do not have an active order')
-        return redirect('cart')
+    product = get_product_or_404(slug)
+    result = cart.change_quantity(request.user, product, None)
+    reset_cart(request)
+    messages.info(request, CART_MESSAGES[result])
+    return redirect('cart')
 
 
 @login_required
 def decrease_quantity_of_item_from_cart(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.products.filter(product__slug=product.slug).exists():
-            order_product = OrderItem.objects.filter(
-                product=product,
-                user=request.user,
-                ordered=False,
-            )[0]
-            if order_product.quantity > 1:
-                order_product.quantity -= 1
-                order_product.save()
-                messages.info(request, 'The quantity of this item was updated')
-            else:
-                order.products.remove(order_product)
-        else:
-            messages.info(request, 'The item was not in your cart')
-        return redirect('cart')
-    else:
-        messages.info(request, 'You do not have an active order')
-        return redirect('cart')
+    product = get_product_or_404(slug)
+    result = cart.change_quantity(request.user, product, -1)
+    reset_cart(request)
+    if result != cart.ITEM_REMOVED:
+        messages.info(request, CART_MESSAGES[result])
+    return redirect('cart')
 
 
 def contact(request):
@@ -41,11 +41,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'eshopper.main.middleware.StaticFilesMiddleware',
+    'eshopper.main.middleware.QueryInstrumentationMiddleware',
+    'eshopper.main.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'eshopper.main.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'eshopper.main.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -75,15 +80,34 @@ WSGI_APPLICATION = 'eshopper.wsgi.application'
 
 DATABASES = {
     'default': {
+        # 'eshopper.main.backends.postgresql_pool' adds a per process connection pool; it is
+        # opt-in until it has been load tested against the production database. Its 'POOL'
+        # entry sets connections per process, seconds to wait for a free one, idle seconds
+        # before a liveness check and seconds after which a connection is replaced:
+        # 'POOL': {'MAX_SIZE': 10, 'TIMEOUT': 5, 'CHECK_AFTER': 30, 'MAX_LIFETIME': 60 * 60},
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': 'eshopper_db',
         'USER': 'postgres',
         'PASSWORD': '1123QwER',
         'HOST': '127.0.0.1',
         'PORT': '5432',
-    }
+    },
+    # every other alias is a streaming replica of default, for example
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'NAME': 'eshopper_db',
+    #     'HOST': '127.0.0.2',
+    #     ...
+    #     'TEST': {'MIRROR': 'default'},
+    # },
 }
 
+DATABASE_ROUTERS = ['eshopper.main.routers.PrimaryReplicaRouter']
+# aliases serving catalog and admin listing reads
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# after a write the client reads from the primary for this long, to outlast the replication lag
+PRIMARY_STICKY_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -123,6 +147,8 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
+# Content-hashed file names plus gzip/brotli siblings, served by StaticFilesMiddleware
+STATICFILES_STORAGE = 'eshopper.main.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_ROOT = BASE_DIR / 'mediafiles'
 MEDIA_URL = '/media/'
@@ -131,3 +157,22 @@ MEDIA_URL = '/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGOUT_REDIRECT_URL = 'index'
+
+# Seconds a rendered category product grid stays cached; product changes invalidate it earlier
+CATEGORY_CACHE_TIMEOUT = 60 * 60
+# Products kept in memory by each process, and seconds a product stays in the shared cache;
+# entries are keyed by a version that changes with the product, so both only bound memory
+PRODUCT_CACHE_SIZE = 1000
+PRODUCT_CACHE_TIMEOUT = 60 * 60 * 24
+# Seconds a related products list stays cached; product changes rebuild the lists of their
+# category earlier
+RELATED_PRODUCTS_TIMEOUT = 60 * 60
+# Seconds a catalog page rendered for anonymous visitors is served from the cache at most;
+# product changes purge the affected pages earlier
+PAGE_CACHE_TIMEOUT = 60 * 10
+# Requests running more queries or spending more milliseconds in the database than this are
+# logged with the fingerprints of their SQL
+SLOW_REQUEST_QUERY_COUNT = 30
+SLOW_REQUEST_DB_MS = 200
+# Report the query count and database time of every response in a Server-Timing header
+SERVER_TIMING_HEADER = DEBUG
@@ -0,0 +1,13 @@
+"""
+Settings for the test suite: ``python manage.py test --settings=eshopper.test_settings``.
+"""
+from eshopper.settings import *  # noqa: F401,F403
+from eshopper.settings import DATABASES
+
+# a second connection to the test database stands in for a streaming replica; reads only go
+# to it in the tests that list it with override_settings(DATABASE_REPLICAS=['replica'])
+DATABASES = {
+    **DATABASES,
+    'replica': {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}},
+}
+DATABASE_REPLICAS = []
@@ -0,0 +1,76 @@
+// Cart page buttons: apply the change through the JSON cart API and update the page in place,
+// instead of following the link and rendering the whole cart again. Without JavaScript, or if
+// the API call fails, the links keep working as before.
+(function () {
+    'use strict';
+
+    function formatPrice(value) {
+        return '$' + value.toFixed(2);
+    }
+
+    function setText(selector, text) {
+        document.querySelectorAll(selector).forEach(function (element) {
+            element.textContent = text;
+        });
+    }
+
+    function render(table, cart) {
+        if (!cart.items.length) {
+            window.location.reload();
+            return;
+        }
+        var items = {};
+        cart.items.forEach(function (item) {
+            items[item.slug] = item;
+        });
+        table.querySelectorAll('[data-cart-item]').forEach(function (row) {
+            var item = items[row.dataset.cartItem];
+            if (!item) {
+                row.parentNode.removeChild(row);
+                return;
+            }
+            row.querySelector('[data-cart-quantity]').textContent = item.quantity;
+            row.querySelector('[data-cart-line-total]').textContent = formatPrice(item.total);
+        });
+        setText('[data-cart-sub-total]', formatPrice(cart.sub_total));
+        setText('[data-cart-shipping-price]', formatPrice(cart.shipping_price));
+        setText('[data-cart-total]', formatPrice(cart.total));
+        setText('[data-cart-count]', cart.items_count);
+    }
+
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest('[data-cart-delta], [data-cart-remove]');
+        var table = link && link.closest('[data-cart-api]');
+        var row = link && link.closest('[data-cart-item]');
+        if (!table || !row) {
+            return;
+        }
+        event.preventDefault();
+
+        var operation = {slug: row.dataset.cartItem};
+        if (link.hasAttribute('data-cart-remove')) {
+            operation.remove = true;
+        } else {
+            operation.delta = parseInt(link.dataset.cartDelta, 10);
+        }
+
+        fetch(table.dataset.cartApi, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': table.querySelector('[name=csrfmiddlewaretoken]').value
+            },
+            body: JSON.stringify({operations: [operation]})
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        }).then(function (data) {
+            render(table, data.cart);
+        }).catch(function () {
+            window.location.href = link.href;
+        });
+    });
+})();